@@ -1,6 +1,19 @@
-from flask import Blueprint, request, jsonify, session
-from models.user import db, User, Service, Order, Payment, Ticket, TicketMessage
+from flask import Blueprint, request, jsonify, session, current_app
+from models.user import db, User, Service, Order, OrderArchive, Payment, Ticket, TicketMessage
+from models.pagination import paginate, InvalidCursor
+from models.catalog_cache import catalog_cache, bump_catalog_version
+from models.balance import credit, set_balance, get_balance
+from models.payment_review import review_payments, REVIEW_ACTIONS, MAX_REVIEW_BATCH
+from models.reconciliation import reconcile, StatementError
+from models.site_settings import settings_cache, all_payment_methods, validate_payment_methods, set_payment_methods
+from models.ticket_messages import message_page, poll_messages, ticket_waiters
+from models.ticket_search import search_tickets, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from models.archive import archive_orders, ARCHIVE_AFTER
+from models.export import EXPORT_FORMATS, order_export_queries, parse_export_date, export_response
+from models.event_bus import event_bus, publish_after_commit, publish_order
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
+from decimal import Decimal
 from sqlalchemy import func, desc
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
@@ -26,12 +39,13 @@ def get_admin_stats():
     try:
         # Basic stats
         total_users = User.query.count()
-        total_orders = Order.query.count()
+        total_orders = Order.query.count() + OrderArchive.query.count()
         total_services = Service.query.filter_by(is_active=True).count()
         pending_tickets = Ticket.query.filter_by(status='Open').count()
         
         # Revenue stats
-        total_revenue = db.session.query(func.sum(Order.charge)).filter_by(status='Completed').scalar() or 0
+        total_revenue = (db.session.query(func.sum(Order.charge)).filter_by(status='Completed').scalar() or 0) + \
+            (db.session.query(func.sum(OrderArchive.charge)).filter_by(status='Completed').scalar() or 0)
         pending_payments = Payment.query.filter_by(status='Pending').count()
         
         # Today's stats
@@ -43,7 +57,9 @@ def get_admin_stats():
         ).scalar() or 0
         
         # Recent activity
-        recent_orders = Order.query.order_by(desc(Order.created_at)).limit(5).all()
+        recent_orders = Order.query.options(
+            joinedload(Order.service).load_only(Service.name)
+        ).order_by(desc(Order.created_at)).limit(5).all()
         recent_users = User.query.order_by(desc(User.created_at)).limit(5).all()
         
         return jsonify({
@@ -64,6 +80,86 @@ def get_admin_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/cache/catalog', methods=['GET'])
+def get_catalog_cache_stats():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    return jsonify({'catalog_cache': catalog_cache.stats()}), 200
+
+@admin_bp.route('/cache/catalog/invalidate', methods=['POST'])
+def invalidate_catalog_cache():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    bump_catalog_version()
+    
+    return jsonify({
+        'message': 'Catalog cache invalidated',
+        'catalog_cache': catalog_cache.stats()
+    }), 200
+
+@admin_bp.route('/events/stats', methods=['GET'])
+def get_event_bus_stats():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    return jsonify({'event_bus': event_bus.stats(), 'ticket_waiters': ticket_waiters.stats()}), 200
+
+@admin_bp.route('/settings/payment-methods', methods=['GET'])
+def get_admin_payment_methods():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        # Includes disabled methods, unlike the public list
+        return jsonify({'methods': all_payment_methods(), 'cache': settings_cache.stats()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/settings/payment-methods', methods=['PUT'])
+def update_payment_methods():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        methods = data.get('methods')
+        
+        error = validate_payment_methods(methods)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # Other workers pick the change up on their next version check
+        set_payment_methods(methods)
+        
+        return jsonify({
+            'message': 'Payment methods updated successfully',
+            'methods': all_payment_methods()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/provider-sync', methods=['GET'])
+def get_provider_sync_metrics():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    engine = current_app.extensions.get('provider_sync')
+    if not engine:
+        return jsonify({'error': 'Provider sync is not running'}), 404
+    
+    return jsonify({'provider_sync': engine.metrics.to_dict()}), 200
+
 # Orders Management
 @admin_bp.route('/orders', methods=['GET'])
 def get_admin_orders():
@@ -72,34 +168,75 @@ def get_admin_orders():
         return auth_check
     
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         status = request.args.get('status')
+        # ?archived=1 lists old finished orders moved out of the live table
+        model = OrderArchive if request.args.get('archived') in ('1', 'true') else Order
         
-        query = Order.query
+        # Service name is joined in, not lazy-loaded per row
+        query = model.query.options(joinedload(model.service).load_only(Service.name))
         
         if status:
-            query = query.filter(Order.status == status)
+            query = query.filter(model.status == status)
         
-        query = query.order_by(desc(Order.created_at))
+        query = query.order_by(desc(model.created_at))
         
-        orders = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        orders = paginate(query, model, default_per_page=20)
         
         return jsonify({
             'orders': [order.to_dict() for order in orders.items],
-            'total': orders.total,
-            'pages': orders.pages,
-            'current_page': page,
-            'per_page': per_page
+            **orders.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/orders/export', methods=['GET'])
+def export_admin_orders():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'format must be csv or ndjson'}), 400
+        
+        statements = order_export_queries(
+            user_id=request.args.get('user_id', type=int),
+            status=request.args.get('status'),
+            start=parse_export_date(request.args.get('from'), 'from'),
+            end=parse_export_date(request.args.get('to'), 'to')
+        )
+        
+        return export_response(statements, fmt, 'orders')
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/orders/archive', methods=['POST'])
+def archive_admin_orders():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        days = data.get('older_than_days', ARCHIVE_AFTER.days)
+        if not isinstance(days, int) or days < 1:
+            return jsonify({'error': 'older_than_days must be a positive integer'}), 400
+        
+        archived = archive_orders(older_than=timedelta(days=days))
+        
+        return jsonify({'message': f'{archived} orders archived', 'archived': archived}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @admin_bp.route('/orders/<int:order_id>/update', methods=['POST'])
 def update_order_status(order_id):
     auth_check = require_admin()
@@ -114,7 +251,7 @@ def update_order_status(order_id):
         if not new_status:
             return jsonify({'error': 'Status is required'}), 400
         
-        valid_statuses = ['Pending', 'In Progress', 'Completed', 'Cancelled', 'Refunded']
+        valid_statuses = ['Pending', 'In Progress', 'Completed', 'Partial', 'Cancelled', 'Refunded']
         if new_status not in valid_statuses:
             return jsonify({'error': 'Invalid status'}), 400
         
@@ -122,21 +259,49 @@ def update_order_status(order_id):
         if not order:
             return jsonify({'error': 'Order not found'}), 404
         
+        # Handle refunds: only the request that flips the status credits the balance,
+        # and only what was not refunded yet (a cancel refunds all, a partial the remains)
+        if new_status == 'Refunded':
+            if order.status in ('Refunded', 'Cancelled'):
+                return jsonify({'error': 'Order is already refunded or cancelled'}), 400
+            
+            amount = Decimal(order.charge) - Decimal(order.refunded_amount or 0)
+            refunded = Order.query.filter_by(id=order_id, status=order.status).update({
+                'status': 'Refunded',
+                'refunded_amount': Order.charge,
+                'updated_at': datetime.utcnow()
+            }, synchronize_session=False)
+            if not refunded:
+                db.session.rollback()
+                return jsonify({'error': 'Order status changed, please retry'}), 409
+            
+            if amount > 0:
+                credit(order.user_id, amount)
+            publish_order(order, status='Refunded')
+            db.session.commit()
+            
+            return jsonify({
+                'message': 'Order updated successfully',
+                'order': order.to_dict()
+            }), 200
+        
         old_status = order.status
         order.status = new_status
         order.notes = notes
         order.updated_at = datetime.utcnow()
         
-        # Handle refunds
-        if new_status == 'Refunded' and old_status != 'Refunded':
-            user = User.query.get(order.user_id)
-            user.balance = float(user.balance) + float(order.charge)
+        # Put the order back in the fulfillment queue with a fresh retry budget
+        if new_status == 'Pending' and old_status != 'Pending':
+            order.fulfillment_attempts = 0
+            order.next_attempt_at = None
+            order.claimed_at = None
         
         # Set completion date
         if new_status == 'Completed':
             order.completed_at = datetime.utcnow()
             order.remains = 0
         
+        publish_order(order)
         db.session.commit()
         
         return jsonify({
@@ -156,8 +321,6 @@ def get_admin_users():
         return auth_check
     
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         search = request.args.get('search')
         
         query = User.query
@@ -170,20 +333,15 @@ def get_admin_users():
         
         query = query.order_by(desc(User.created_at))
         
-        users = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        users = paginate(query, User, default_per_page=20)
         
         return jsonify({
             'users': [user.to_dict() for user in users.items],
-            'total': users.total,
-            'pages': users.pages,
-            'current_page': page,
-            'per_page': per_page
+            **users.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -201,21 +359,20 @@ def update_user_balance(user_id):
         if action not in ['add', 'set']:
             return jsonify({'error': 'Invalid action'}), 400
         
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
         if action == 'add':
-            user.balance = float(user.balance) + amount
+            updated = credit(user_id, amount)
         else:  # set
-            user.balance = amount
+            updated = set_balance(user_id, amount)
+        
+        if not updated:
+            db.session.rollback()
+            return jsonify({'error': 'User not found'}), 404
         
-        user.updated_at = datetime.utcnow()
         db.session.commit()
         
         return jsonify({
             'message': 'Balance updated successfully',
-            'new_balance': float(user.balance)
+            'new_balance': float(get_balance(user_id))
         }), 200
         
     except Exception as e:
@@ -230,8 +387,6 @@ def get_admin_payments():
         return auth_check
     
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         status = request.args.get('status')
         
         query = Payment.query
@@ -241,23 +396,35 @@ def get_admin_payments():
         
         query = query.order_by(desc(Payment.created_at))
         
-        payments = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        payments = paginate(query, Payment, default_per_page=20)
         
         return jsonify({
             'payments': [payment.to_dict() for payment in payments.items],
-            'total': payments.total,
-            'pages': payments.pages,
-            'current_page': page,
-            'per_page': per_page
+            **payments.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _review_single_payment(payment_id, action, message):
+    data = request.get_json(silent=True) or {}
+    admin_notes = data.get('notes', '')
+    
+    result = review_payments([payment_id], action, admin_notes)[0]
+    if 'error' in result:
+        db.session.rollback()
+        status_code = 404 if result['error'] == 'Payment not found' else 400
+        return jsonify({'error': result['error']}), status_code
+    
+    db.session.commit()
+    
+    return jsonify({
+        'message': message,
+        'payment': db.session.get(Payment, payment_id).to_dict()
+    }), 200
+
 @admin_bp.route('/payments/<int:payment_id>/approve', methods=['POST'])
 def approve_payment(payment_id):
     auth_check = require_admin()
@@ -265,31 +432,8 @@ def approve_payment(payment_id):
         return auth_check
     
     try:
-        data = request.get_json()
-        admin_notes = data.get('notes', '')
-        
-        payment = Payment.query.get(payment_id)
-        if not payment:
-            return jsonify({'error': 'Payment not found'}), 404
-        
-        if payment.status != 'Pending':
-            return jsonify({'error': 'Payment is not pending'}), 400
-        
-        # Update payment
-        payment.status = 'Approved'
-        payment.notes = admin_notes
-        payment.updated_at = datetime.utcnow()
-        
-        # Add balance to user
-        user = User.query.get(payment.user_id)
-        user.balance = float(user.balance) + float(payment.amount)
-        
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Payment approved successfully',
-            'payment': payment.to_dict()
-        }), 200
+        # Credits the user's balance in the same transaction
+        return _review_single_payment(payment_id, 'approve', 'Payment approved successfully')
         
     except Exception as e:
         db.session.rollback()
@@ -302,32 +446,85 @@ def reject_payment(payment_id):
         return auth_check
     
     try:
-        data = request.get_json()
-        admin_notes = data.get('notes', '')
+        return _review_single_payment(payment_id, 'reject', 'Payment rejected successfully')
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/payments/bulk', methods=['POST'])
+def bulk_review_payments():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        action = data.get('action')
+        payment_ids = data.get('payment_ids')
         
-        payment = Payment.query.get(payment_id)
-        if not payment:
-            return jsonify({'error': 'Payment not found'}), 404
+        if action not in REVIEW_ACTIONS:
+            return jsonify({'error': 'action must be approve or reject'}), 400
         
-        if payment.status != 'Pending':
-            return jsonify({'error': 'Payment is not pending'}), 400
+        if not isinstance(payment_ids, list) or not payment_ids or \
+                not all(isinstance(payment_id, int) for payment_id in payment_ids):
+            return jsonify({'error': 'payment_ids must be a non-empty list of ids'}), 400
         
-        # Update payment
-        payment.status = 'Rejected'
-        payment.notes = admin_notes
-        payment.updated_at = datetime.utcnow()
+        # Keep the first occurrence of each id
+        payment_ids = list(dict.fromkeys(payment_ids))
+        if len(payment_ids) > MAX_REVIEW_BATCH:
+            return jsonify({'error': f'At most {MAX_REVIEW_BATCH} payments per request'}), 400
         
+        # One transaction: status UPDATE ... RETURNING plus one balance UPDATE per user
+        results = review_payments(payment_ids, action, data.get('notes', ''))
         db.session.commit()
         
+        succeeded = sum(1 for result in results if 'error' not in result)
         return jsonify({
-            'message': 'Payment rejected successfully',
-            'payment': payment.to_dict()
+            'message': f'{succeeded} payments {REVIEW_ACTIONS[action].lower()}',
+            'succeeded_count': succeeded,
+            'error_count': len(results) - succeeded,
+            'results': results
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/payments/reconcile', methods=['POST'])
+def reconcile_payments():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        statement = request.files.get('statement')
+        if not statement or not statement.filename:
+            return jsonify({'error': 'statement file is required'}), 400
+        
+        # Transaction ids are only unique per payment method, so a statement covers one method
+        payment_method = request.form.get('payment_method')
+        if not payment_method:
+            return jsonify({'error': 'payment_method is required'}), 400
+        if payment_method not in [method['name'] for method in all_payment_methods()]:
+            return jsonify({'error': 'Invalid payment method'}), 400
+        
+        # Exact transaction id + amount matches are approved; near-misses come back for review
+        report = reconcile(
+            statement.stream,
+            statement.filename,
+            payment_method,
+            dry_run=request.form.get('dry_run') in ('1', 'true')
+        )
+        
+        return jsonify(report), 200
+        
+    except StatementError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 # Tickets Management
 @admin_bp.route('/tickets', methods=['GET'])
 def get_admin_tickets():
@@ -336,31 +533,109 @@ def get_admin_tickets():
         return auth_check
     
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         status = request.args.get('status')
+        # sort=last_message puts the most recently active tickets first
+        sort_column = Ticket.last_message_at if request.args.get('sort') == 'last_message' else Ticket.created_at
         
         query = Ticket.query
         
         if status:
             query = query.filter(Ticket.status == status)
         
-        query = query.order_by(desc(Ticket.created_at))
+        query = query.order_by(desc(sort_column), desc(Ticket.id))
         
-        tickets = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        tickets = paginate(query, Ticket, default_per_page=20, sort_column=sort_column)
         
         return jsonify({
             'tickets': [ticket.to_dict() for ticket in tickets.items],
-            'total': tickets.total,
-            'pages': tickets.pages,
-            'current_page': page,
-            'per_page': per_page
+            **tickets.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/tickets/search', methods=['GET'])
+def search_admin_tickets():
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
+        
+        try:
+            per_page = min(max(int(request.args.get('per_page', DEFAULT_SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+            page = max(int(request.args.get('page', 1)), 1)
+        except ValueError:
+            return jsonify({'error': 'page and per_page must be integers'}), 400
+        
+        # Ranked by the full-text index over subjects and messages (ticket_search)
+        results, has_more = search_tickets(
+            query,
+            status=request.args.get('status'),
+            limit=per_page,
+            offset=(page - 1) * per_page
+        )
+        
+        return jsonify({
+            'results': results,
+            'page': page,
+            'per_page': per_page,
+            'has_more': has_more
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/tickets/<int:ticket_id>/messages', methods=['GET'])
+def get_admin_ticket_messages(ticket_id):
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        ticket = Ticket.query.get(ticket_id)
+        if not ticket:
+            return jsonify({'error': 'Ticket not found'}), 404
+        
+        messages, meta = message_page(ticket_id, request.args)
+        
+        return jsonify({
+            'ticket': ticket.to_dict(),
+            'messages': [message.to_dict() for message in messages],
+            **meta
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/tickets/<int:ticket_id>/messages/poll', methods=['GET'])
+def poll_admin_ticket_messages(ticket_id):
+    auth_check = require_admin()
+    if auth_check:
+        return auth_check
+    
+    try:
+        ticket = Ticket.query.get(ticket_id)
+        if not ticket:
+            return jsonify({'error': 'Ticket not found'}), 404
+        
+        messages, meta = poll_messages(ticket_id, request.args)
+        
+        return jsonify({
+            'ticket': ticket.to_dict(),
+            'messages': [message.to_dict() for message in messages],
+            **meta
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -381,19 +656,18 @@ def reply_to_ticket(ticket_id):
         if not ticket:
             return jsonify({'error': 'Ticket not found'}), 404
         
-        # Create admin reply
-        ticket_message = TicketMessage(
-            ticket_id=ticket_id,
-            user_id=None,  # Admin message
-            message=message,
-            is_admin_reply=True
-        )
+        # Create admin reply (sent as the replying admin) and bump the ticket counters
+        ticket_message = ticket.add_message(session['user_id'], message, is_admin_reply=True)
         
         # Update ticket status
         ticket.status = 'Answered'
-        ticket.updated_at = datetime.utcnow()
         
-        db.session.add(ticket_message)
+        db.session.flush()
+        publish_after_commit(ticket.user_id, 'ticket_reply', {
+            'ticket_id': ticket.id,
+            'message_id': ticket_message.id,
+            'status': ticket.status
+        })
         db.session.commit()
         
         return jsonify({
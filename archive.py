@@ -0,0 +1,75 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert
+from models.user import db, Order, OrderArchive
+
+logger = logging.getLogger(__name__)
+
+# Orders in these states are final and safe to move out of the live table
+ARCHIVE_STATUSES = ['Completed', 'Partial', 'Cancelled', 'Refunded']
+ARCHIVE_AFTER = timedelta(days=30)
+ARCHIVE_BATCH_SIZE = 1000
+
+ARCHIVED_COLUMNS = [
+    'id', 'user_id', 'service_id', 'link', 'target_hash', 'quantity', 'charge',
+    'refunded_amount', 'start_count', 'remains', 'status', 'provider_order_id', 'created_at', 'updated_at'
+]
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move one batch of old terminal orders to the archive; returns how many moved"""
+    orders = Order.__table__
+    # The newest order always stays live: without AUTOINCREMENT SQLite would hand
+    # its id to the next order, colliding with the archived copy
+    newest_id = db.session.query(func.max(Order.id)).scalar() or 0
+    order_ids = [row[0] for row in db.session.query(Order.id).filter(
+        Order.status.in_(ARCHIVE_STATUSES),
+        Order.updated_at < cutoff,
+        Order.id < newest_id
+    ).order_by(Order.id).limit(batch_size)]
+    if not order_ids:
+        return 0
+
+    # DELETE ... RETURNING hands over exactly the rows removed, so an order whose
+    # status changed since the SELECT above stays live
+    rows = db.session.execute(
+        delete(orders)
+        .where(orders.c.id.in_(order_ids), orders.c.status.in_(ARCHIVE_STATUSES))
+        .returning(*[orders.c[name] for name in ARCHIVED_COLUMNS])
+    ).all()
+    if rows:
+        now = datetime.utcnow()
+        db.session.execute(
+            insert(OrderArchive.__table__),
+            [dict(row._mapping, archived_at=now) for row in rows]
+        )
+    db.session.commit()
+    return len(rows)
+
+
+def archive_orders(older_than=ARCHIVE_AFTER, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """Archive terminal orders untouched for older_than, one short transaction per batch"""
+    cutoff = datetime.utcnow() - older_than
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+    if moved:
+        logger.info('Archived %s orders in %s batches', moved, batches)
+    return moved
+
+
+def find_order(order_id, user_id=None):
+    """Look up an order in the live table, falling back to the archive"""
+    for model in (Order, OrderArchive):
+        query = model.query.filter_by(id=order_id)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        order = query.first()
+        if order:
+            return order
+    return None
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, session
 from werkzeug.security import generate_password_hash, check_password_hash
 from models.user import db, User
+from models.stats import dashboard_stats
 from datetime import datetime
 import re
 
@@ -144,6 +145,18 @@ def get_current_user():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@auth_bp.route('/me/stats', methods=['GET'])
+def get_current_user_stats():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        # Order, payment and ticket stats for the dashboard in one round trip
+        return jsonify(dashboard_stats(session['user_id'])), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @auth_bp.route('/change-password', methods=['POST'])
 def change_password():
     try:
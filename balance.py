@@ -0,0 +1,88 @@
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import text, update
+from models.user import db, User
+from models.event_bus import publish_after_commit
+
+# الأرصدة مخزنة بالقروش كأعداد صحيحة
+MINOR_UNITS = 100
+CENT = Decimal('0.01')
+
+
+def to_minor(amount):
+    """Convert an amount in pounds to integer piastres, rounding half up"""
+    return int(Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP) * MINOR_UNITS)
+
+
+def from_minor(minor):
+    return (Decimal(minor) / MINOR_UNITS).quantize(CENT)
+
+
+def round_amount(amount):
+    return from_minor(to_minor(amount))
+
+
+def _execute(stmt):
+    # Loaded User objects are refreshed on commit; skip in-session synchronization
+    return db.session.execute(stmt.execution_options(synchronize_session=False))
+
+
+def _apply(user_id, stmt):
+    """Run a balance UPDATE; publishes the new balance to the user's event stream on commit"""
+    row = _execute(stmt.returning(User.balance_minor)).first()
+    if row is None:
+        return False
+    publish_after_commit(user_id, 'balance', {'balance': float(from_minor(row[0]))})
+    return True
+
+
+def debit(user_id, amount):
+    """Subtract amount in a single conditional UPDATE; False if the balance does not cover it"""
+    minor = to_minor(amount)
+    return _apply(user_id, (
+        update(User)
+        .where(User.id == user_id, User.balance_minor >= minor)
+        .values(balance_minor=User.balance_minor - minor)
+    ))
+
+
+def credit(user_id, amount):
+    """Add amount to the user's balance; False if the user does not exist"""
+    minor = to_minor(amount)
+    return _apply(user_id, (
+        update(User)
+        .where(User.id == user_id)
+        .values(balance_minor=User.balance_minor + minor)
+    ))
+
+
+def set_balance(user_id, amount):
+    return _apply(user_id, (
+        update(User)
+        .where(User.id == user_id)
+        .values(balance_minor=to_minor(amount))
+    ))
+
+
+def get_balance(user_id):
+    minor = db.session.query(User.balance_minor).filter(User.id == user_id).scalar()
+    return from_minor(minor) if minor is not None else None
+
+
+def migrate_legacy_balance():
+    """Add users.balance_minor to databases created before it and copy the old balance into it
+
+    Returns True when the column was added. The legacy balance column is left
+    in place (no longer read or written) so the previous release can still start.
+    """
+    table = User.__table__.name
+    columns = [row[1] for row in db.session.execute(text(f'PRAGMA table_info("{table}")'))]
+    if not columns or 'balance_minor' in columns:
+        return False
+
+    db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN balance_minor INTEGER NOT NULL DEFAULT 0'))
+    if 'balance' in columns:
+        db.session.execute(text(
+            f'UPDATE "{table}" SET balance_minor = CAST(ROUND(COALESCE(balance, 0) * {MINOR_UNITS}) AS INTEGER)'
+        ))
+    db.session.commit()
+    return True
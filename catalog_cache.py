@@ -0,0 +1,210 @@
+import math
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models.user import db, Service, SiteSetting
+from models.search_index import ServiceSearchIndex
+
+POPULAR_LIMIT = 6
+# Bumped in the same transaction as every Service write; other workers compare it to drop their snapshot
+VERSION_KEY = 'catalog_version'
+# Seconds between version checks; reads in between never touch the database
+CHECK_INTERVAL = 15
+
+
+class CatalogSnapshot:
+    """Immutable view of the active service catalog built from Service.to_dict()"""
+
+    def __init__(self, version, services):
+        self.version = version
+        self.by_id = {service['id']: service for service in services}
+        self.active = [service for service in services if service['is_active']]
+
+        self.platforms = []
+        self.categories = []
+        self.categories_by_platform = {}
+        self.views = {(None, None): self.active}
+        self._search_index = None
+
+        for service in self.active:
+            platform = service['platform']
+            category = service['service_type']
+
+            if platform not in self.categories_by_platform:
+                self.platforms.append(platform)
+                self.categories_by_platform[platform] = []
+            if category not in self.categories_by_platform[platform]:
+                self.categories_by_platform[platform].append(category)
+            if category not in self.categories:
+                self.categories.append(category)
+
+            for key in ((platform, None), (None, category), (platform, category)):
+                self.views.setdefault(key, []).append(service)
+
+    def view(self, platform=None, category=None):
+        return self.views.get((platform or None, category or None), [])
+
+    @property
+    def search_index(self):
+        # Built on first search so catalog reads never pay for indexing
+        if self._search_index is None:
+            self._search_index = ServiceSearchIndex(self.active)
+        return self._search_index
+
+    def search(self, query, platform=None, category=None):
+        results = [self.by_id[service_id] for service_id in self.search_index.search(query)]
+        if platform:
+            results = [service for service in results if service['platform'] == platform]
+        if category:
+            results = [service for service in results if service['service_type'] == category]
+        return results
+
+
+class CatalogCache:
+    """Process-wide cache of the service catalog, rebuilt when the shared version changes"""
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot else None
+
+    def _stored_version(self):
+        value = db.session.query(SiteSetting.setting_value).filter_by(setting_key=VERSION_KEY).scalar()
+        return int(value or 0)
+
+    def invalidate(self):
+        """Force the next read to check the stored version"""
+        with self._lock:
+            self._checked_at = 0.0
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                self.hits += 1
+                return snapshot
+            version = self._stored_version()
+            if snapshot is None or snapshot.version != version:
+                self.misses += 1
+                services = Service.query.order_by(Service.id).all()
+                snapshot = CatalogSnapshot(version, [service.to_dict() for service in services])
+                self._snapshot = snapshot
+            else:
+                self.hits += 1
+            self._checked_at = time.monotonic()
+        return snapshot
+
+    def get(self, service_id):
+        return self.snapshot().by_id.get(service_id)
+
+    def services(self, platform=None, category=None):
+        return self.snapshot().view(platform, category)
+
+    def search(self, query, platform=None, category=None):
+        return self.snapshot().search(query, platform, category)
+
+    def paginate(self, platform=None, category=None, page=1, per_page=20, search=None):
+        if search:
+            items = self.search(search, platform, category)
+        else:
+            items = self.services(platform, category)
+        total = len(items)
+        start = (page - 1) * per_page
+        return {
+            'items': items[start:start + per_page] if start >= 0 else [],
+            'total': total,
+            'pages': int(math.ceil(total / float(per_page))) if per_page else 0
+        }
+
+    def platforms(self):
+        return self.snapshot().platforms
+
+    def categories(self, platform=None):
+        snapshot = self.snapshot()
+        if platform:
+            return snapshot.categories_by_platform.get(platform, [])
+        return snapshot.categories
+
+    def popular(self, limit=POPULAR_LIMIT):
+        return self.snapshot().active[:limit]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / float(lookups), 4) if lookups else 0.0,
+            'services': len(self._snapshot.by_id) if self._snapshot else 0,
+            'check_interval': self.check_interval
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+def _bump_stored_version(connection):
+    settings = SiteSetting.__table__
+    bumped = connection.execute(
+        settings.update()
+        .where(settings.c.setting_key == VERSION_KEY)
+        .values(setting_value=db.cast(db.cast(settings.c.setting_value, db.Integer) + 1, db.String))
+    ).rowcount
+    if not bumped:
+        connection.execute(settings.insert().values(
+            setting_key=VERSION_KEY, setting_value='1', description='إصدار كتالوج الخدمات'
+        ))
+
+
+def bump_catalog_version():
+    """Make every worker rebuild its snapshot on its next version check"""
+    _bump_stored_version(db.session.connection())
+    db.session.commit()
+    catalog_cache.invalidate()
+
+
+# Any Service write bumps the stored version once per transaction, so it commits or rolls back with it
+@event.listens_for(Service, 'after_insert')
+@event.listens_for(Service, 'after_update')
+@event.listens_for(Service, 'after_delete')
+def _mark_catalog_dirty(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and not session.info.get('catalog_dirty'):
+        _bump_stored_version(connection)
+        session.info['catalog_dirty'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_catalog_dirty_bulk(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        session = orm_execute_state.session
+        if not session.info.get('catalog_dirty') and any(
+            mapper.class_ is Service for mapper in orm_execute_state.all_mappers
+        ):
+            _bump_stored_version(session.connection())
+            session.info['catalog_dirty'] = True
+
+
+# The committing worker re-checks right away; the others within CHECK_INTERVAL
+@event.listens_for(Session, 'after_commit')
+def _bump_catalog_version(session):
+    if session.info.pop('catalog_dirty', False):
+        catalog_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_dirty(session):
+    session.info.pop('catalog_dirty', None)
@@ -6,7 +6,7 @@ CREATE TABLE users (
     username VARCHAR(50) UNIQUE NOT NULL,
     email VARCHAR(100) UNIQUE NOT NULL,
     password_hash VARCHAR(255) NOT NULL,
-    balance DECIMAL(10, 2) DEFAULT 0.00,
+    balance_minor INTEGER NOT NULL DEFAULT 0, -- الرصيد بالقروش
     is_admin BOOLEAN DEFAULT FALSE,
     two_factor_enabled BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -24,6 +24,7 @@ CREATE TABLE services (
     max_quantity INTEGER NOT NULL,
     description TEXT,
     is_active BOOLEAN DEFAULT TRUE,
+    provider_service_id VARCHAR(64), -- رقم الخدمة لدى المزود الخارجي (يُستخدم الرقم المحلي إذا كان فارغاً)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -34,17 +35,54 @@ CREATE TABLE orders (
     user_id INTEGER NOT NULL,
     service_id INTEGER NOT NULL,
     link VARCHAR(500) NOT NULL,
+    target_hash VARCHAR(40), -- بصمة الرابط بعد توحيده
     quantity INTEGER NOT NULL,
     charge DECIMAL(10, 2) NOT NULL,
+    refunded_amount DECIMAL(10, 2) NOT NULL DEFAULT 0, -- ما أعيد للرصيد من قيمة الطلب
     start_count INTEGER DEFAULT 0,
     remains INTEGER DEFAULT 0,
-    status VARCHAR(20) DEFAULT 'Pending', -- Pending, In Progress, Completed, Cancelled, Partial
+    status VARCHAR(20) DEFAULT 'Pending', -- Pending, Processing, In Progress, Completed, Cancelled, Partial
+    provider_order_id VARCHAR(64),
+    fulfillment_attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP,
+    claimed_at TIMESTAMP,
+    last_error TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (service_id) REFERENCES services(id)
 );
 
+-- أرشيف الطلبات المنتهية القديمة (نفس أرقام الطلبات الأصلية)
+CREATE TABLE order_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    service_id INTEGER NOT NULL,
+    link VARCHAR(500) NOT NULL,
+    target_hash VARCHAR(40),
+    quantity INTEGER NOT NULL,
+    charge DECIMAL(10, 2) NOT NULL,
+    refunded_amount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+    start_count INTEGER DEFAULT 0,
+    remains INTEGER DEFAULT 0,
+    status VARCHAR(20) NOT NULL, -- Completed, Partial, Cancelled, Refunded
+    provider_order_id VARCHAR(64),
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (service_id) REFERENCES services(id)
+);
+
+-- عدادات الطلبات ودرجة الشعبية لكل خدمة
+CREATE TABLE service_stats (
+    service_id INTEGER PRIMARY KEY,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    popularity_score REAL NOT NULL DEFAULT 0,
+    last_ordered_at TIMESTAMP,
+    FOREIGN KEY (service_id) REFERENCES services(id)
+);
+
 -- جدول المدفوعات
 CREATE TABLE payments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -54,6 +92,7 @@ CREATE TABLE payments (
     transaction_id VARCHAR(100),
     status VARCHAR(20) DEFAULT 'Pending', -- Pending, Completed, Failed
     notes TEXT,
+    receipt_image VARCHAR(500), -- رابط صورة الإيصال
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
@@ -66,6 +105,9 @@ CREATE TABLE tickets (
     subject VARCHAR(200) NOT NULL,
     status VARCHAR(20) DEFAULT 'Open', -- Open, Answered, Awaiting Reply, Closed
     priority VARCHAR(10) DEFAULT 'Normal', -- Low, Normal, High, Urgent
+    message_count INTEGER NOT NULL DEFAULT 0, -- عدد الرسائل (مخزن مسبقاً)
+    last_message_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- وقت آخر رسالة (وقت الإنشاء إن لم توجد رسائل)
+    last_reply_by_admin BOOLEAN NOT NULL DEFAULT FALSE, -- هل آخر رسالة من الإدارة
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
@@ -84,6 +126,31 @@ CREATE TABLE ticket_messages (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+-- فهرس البحث النصي في عناوين التذاكر ورسائلها (FTS5، نص مُطبَّع، صف لكل عنوان ورسالة)
+CREATE VIRTUAL TABLE ticket_search USING fts5(
+    subject,
+    message,
+    ticket_id UNINDEXED,
+    message_id UNINDEXED,
+    prefix='2 3'
+);
+
+-- جدول الملفات المرفوعة (المحتوى مخزن مرة واحدة حسب sha256)
+CREATE TABLE uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    sha256 VARCHAR(64) NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    size INTEGER NOT NULL,
+    original_name VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'processing', -- processing, ready, failed
+    width INTEGER,
+    height INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, sha256),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
 -- جدول الإشعارات
 CREATE TABLE notifications (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -95,6 +162,22 @@ CREATE TABLE notifications (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+-- مفاتيح منع تكرار الطلبات (Idempotency-Key)
+CREATE TABLE idempotency_keys (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    endpoint VARCHAR(100) NOT NULL,
+    key VARCHAR(100) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'processing', -- processing, completed
+    response_status INTEGER,
+    response_body TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    UNIQUE (user_id, endpoint, key),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
 -- جدول إعدادات الموقع
 CREATE TABLE site_settings (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -110,14 +193,38 @@ INSERT INTO site_settings (setting_key, setting_value, description) VALUES
 ('site_owner', '👑alaa badeeh 👑', 'صاحب السيرفر'),
 ('maintenance_mode', 'false', 'وضع الصيانة'),
 ('min_deposit', '10.00', 'الحد الأدنى للإيداع'),
-('currency', 'EGP', 'العملة المستخدمة');
+('currency', 'EGP', 'العملة المستخدمة'),
+('settings_version', '0', 'إصدار الإعدادات، يزداد مع كل تعديل لتحديث النسخ المخزنة مؤقتاً');
 
 -- إنشاء فهارس لتحسين الأداء
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_orders_user_id ON orders(user_id);
 CREATE INDEX idx_orders_status ON orders(status);
+CREATE INDEX idx_orders_fulfillment ON orders(status, next_attempt_at);
+CREATE INDEX idx_orders_provider_order_id ON orders(provider_order_id);
+CREATE INDEX idx_orders_target ON orders(target_hash, service_id);
+CREATE INDEX idx_orders_status_updated ON orders(status, updated_at);
+CREATE INDEX idx_service_stats_popularity ON service_stats(popularity_score);
 CREATE INDEX idx_payments_user_id ON payments(user_id);
+CREATE UNIQUE INDEX uq_payments_transaction ON payments(payment_method, transaction_id);
 CREATE INDEX idx_tickets_user_id ON tickets(user_id);
-CREATE INDEX idx_ticket_messages_ticket_id ON ticket_messages(ticket_id);
+CREATE INDEX idx_ticket_messages_ticket_id ON ticket_messages(ticket_id, id);
 CREATE INDEX idx_notifications_user_id ON notifications(user_id);
+CREATE INDEX idx_uploads_sha256 ON uploads(sha256);
+CREATE INDEX idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+
+-- فهارس الترقيم بالمؤشر (created_at, id)
+CREATE INDEX idx_users_created ON users(created_at, id);
+CREATE INDEX idx_orders_created ON orders(created_at, id);
+CREATE INDEX idx_orders_user_created ON orders(user_id, created_at, id);
+CREATE INDEX idx_orders_status_created ON orders(status, created_at, id);
+CREATE INDEX idx_order_archive_created ON order_archive(created_at, id);
+CREATE INDEX idx_order_archive_user_created ON order_archive(user_id, created_at, id);
+CREATE INDEX idx_order_archive_status_created ON order_archive(status, created_at, id);
+CREATE INDEX idx_payments_created ON payments(created_at, id);
+CREATE INDEX idx_payments_user_created ON payments(user_id, created_at, id);
+CREATE INDEX idx_tickets_created ON tickets(created_at, id);
+CREATE INDEX idx_tickets_user_created ON tickets(user_id, created_at, id);
+CREATE INDEX idx_tickets_last_message ON tickets(last_message_at, id);
+CREATE INDEX idx_tickets_status_last_message ON tickets(status, last_message_at, id);
 
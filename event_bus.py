@@ -0,0 +1,142 @@
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models.user import db
+
+# Recent events kept for clients reconnecting with Last-Event-ID
+BUFFER_SIZE = 1000
+# Undelivered events per connection before it is dropped (the client reconnects and replays)
+SUBSCRIBER_QUEUE_SIZE = 100
+MAX_SUBSCRIPTIONS_PER_USER = 5
+
+
+class Event:
+    def __init__(self, event_id, user_id, event_type, data):
+        self.id = event_id
+        self.user_id = user_id
+        self.type = event_type
+        self.data = data
+
+    def encode(self):
+        """Server-Sent Events wire format"""
+        return f'id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, ensure_ascii=False)}\n\n'
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next event, or None when nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """In-process pub/sub of per-user events with a replay buffer
+
+    Events only reach subscribers in the same process; with several workers a
+    client receives what its own worker publishes.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscriptions = {}
+
+    def publish(self, user_id, event_type, data):
+        with self._lock:
+            published = Event(next(self._ids), user_id, event_type, data)
+            self._buffer.append(published)
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(published)
+            except queue.Full:
+                # A stalled reader must not hold events for everyone else
+                subscription.overflowed = True
+        return published
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Register a subscriber; returns (subscription, missed events, complete replay?)"""
+        subscription = Subscription(user_id)
+        with self._lock:
+            subscriptions = self._subscriptions.setdefault(user_id, [])
+            if len(subscriptions) >= MAX_SUBSCRIPTIONS_PER_USER:
+                return None, [], False
+            subscriptions.append(subscription)
+
+            missed = []
+            complete = True
+            if last_event_id is not None:
+                missed = [item for item in self._buffer if item.id > last_event_id and item.user_id == user_id]
+                oldest = self._buffer[0].id if self._buffer else None
+                newest = self._buffer[-1].id if self._buffer else 0
+                # Events between last_event_id and the buffer start were evicted, or
+                # the id comes from before a restart (ids start again at 1)
+                complete = (oldest is None or last_event_id >= oldest - 1) and last_event_id <= newest
+        return subscription, missed, complete
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+                'users': len(self._subscriptions),
+                'buffered_events': len(self._buffer),
+                'last_event_id': self._buffer[-1].id if self._buffer else 0
+            }
+
+
+event_bus = EventBus()
+
+
+def publish_after_commit(user_id, event_type, data):
+    """Queue an event on the current transaction; it is published only if the transaction commits"""
+    db.session.info.setdefault('pending_events', []).append((user_id, event_type, data))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    for user_id, event_type, data in session.info.pop('pending_events', []):
+        event_bus.publish(user_id, event_type, data)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('pending_events', None)
+
+
+def order_payload(order_id, status, remains, start_count):
+    """Fields the order list needs to update a row in place"""
+    return {'order_id': order_id, 'status': status, 'remains': remains, 'start_count': start_count}
+
+
+def publish_order(order, status=None):
+    """Queue an 'order' event; status overrides the loaded value after a bulk UPDATE"""
+    publish_after_commit(order.user_id, 'order', order_payload(
+        order.id, status or order.status, order.remains, order.start_count
+    ))
+
+
+def publish_orders(orders_by_user):
+    """Queue one 'order_batch' event per user so large batches do not overflow a stream"""
+    for user_id, payloads in orders_by_user.items():
+        publish_after_commit(user_id, 'order_batch', {'orders': payloads})
@@ -0,0 +1,51 @@
+from flask import Blueprint, request, jsonify, session, Response
+from models.event_bus import event_bus
+
+events_bp = Blueprint('events', __name__, url_prefix='/api/events')
+
+# Comment lines keep proxies and browsers from closing an idle stream
+HEARTBEAT_INTERVAL = 15
+# Browser reconnect delay after the stream drops (milliseconds)
+RETRY_MS = 3000
+
+def parse_last_event_id():
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+@events_bp.route('/stream', methods=['GET'])
+def stream_events():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        user_id = session['user_id']
+        subscription, missed, complete = event_bus.subscribe(user_id, parse_last_event_id())
+        if subscription is None:
+            return jsonify({'error': 'Too many open event streams'}), 429
+        
+        def generate():
+            try:
+                yield f'retry: {RETRY_MS}\n\n'
+                if not complete:
+                    # Some events were evicted from the replay buffer; the client should refetch
+                    yield 'event: resync\ndata: {}\n\n'
+                for missed_event in missed:
+                    yield missed_event.encode()
+                
+                # No database access while idle: the thread just waits on the queue
+                while not subscription.overflowed:
+                    next_event = subscription.get(timeout=HEARTBEAT_INTERVAL)
+                    yield next_event.encode() if next_event else ': heartbeat\n\n'
+            finally:
+                event_bus.unsubscribe(subscription)
+        
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,137 @@
+import csv
+import heapq
+import io
+import itertools
+import json
+from datetime import datetime
+from decimal import Decimal
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from models.user import db, Order, OrderArchive, Service
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson'
+}
+# Rows fetched from the server-side cursor per round trip
+EXPORT_BATCH_SIZE = 1000
+
+ORDER_EXPORT_FIELDS = [
+    'id', 'user_id', 'service_id', 'service_name', 'link', 'quantity', 'charge',
+    'start_count', 'remains', 'status', 'provider_order_id', 'created_at', 'updated_at'
+]
+
+
+def parse_export_date(value, name):
+    """Parse an optional ISO date/datetime query argument"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO date, e.g. 2025-01-31')
+
+
+def _order_export_select(model, user_id, status, start, end):
+    stmt = select(*[
+        Service.name.label(name) if name == 'service_name' else getattr(model, name).label(name)
+        for name in ORDER_EXPORT_FIELDS
+    ]).outerjoin(Service, model.service_id == Service.id)
+    if user_id is not None:
+        stmt = stmt.where(model.user_id == user_id)
+    if status:
+        stmt = stmt.where(model.status == status)
+    if start:
+        stmt = stmt.where(model.created_at >= start)
+    if end:
+        stmt = stmt.where(model.created_at < end)
+    return stmt.order_by(model.created_at, model.id)
+
+
+def order_export_queries(user_id=None, status=None, start=None, end=None):
+    """Live and archived orders with their service name, each oldest first (walks the created_at indexes)"""
+    return [
+        _order_export_select(Order, user_id, status, start, end),
+        _order_export_select(OrderArchive, user_id, status, start, end)
+    ]
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _rows(stmt):
+    """Yield rows batch by batch without ever holding the whole export in memory"""
+    result = db.session.execute(
+        stmt.execution_options(yield_per=EXPORT_BATCH_SIZE, stream_results=True)
+    )
+    try:
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        # Releases the cursor when the client disconnects mid-download
+        result.close()
+
+
+def _sort_key(row):
+    return (row.created_at or datetime.min, row.id)
+
+
+def _batches(statements):
+    """Merge the already sorted streams by (created_at, id) and regroup them into batches"""
+    rows = heapq.merge(*[_rows(stmt) for stmt in statements], key=_sort_key)
+    while True:
+        batch = list(itertools.islice(rows, EXPORT_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _csv_chunks(statements, names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    # Header goes out before the query runs so the first byte is immediate
+    yield buffer.getvalue()
+
+    for batch in _batches(statements):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(statements, names):
+    for batch in _batches(statements):
+        yield ''.join(
+            json.dumps(dict(zip(names, map(_json_value, row))), ensure_ascii=False) + '\n'
+            for row in batch
+        )
+
+
+def export_response(statements, fmt, filename):
+    """Stream one or more select()s with the same columns as a single CSV or NDJSON attachment"""
+    names = list(statements[0].selected_columns.keys())
+    chunks = _csv_chunks(statements, names) if fmt == 'csv' else _ndjson_chunks(statements, names)
+    return Response(
+        stream_with_context(chunks),
+        content_type=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}.{fmt}',
+            'Cache-Control': 'no-store',
+            # Keep reverse proxies from buffering the whole download
+            'X-Accel-Buffering': 'no'
+        }
+    )
@@ -0,0 +1,146 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from models.user import db, Order, Service
+from models.providers import ProviderError
+from models.event_bus import publish_order
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BASE_BACKOFF = timedelta(seconds=30)
+MAX_BACKOFF = timedelta(hours=1)
+# Orders left in Processing longer than this (worker crash) are queued again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def retry_delay(attempts):
+    return min(BASE_BACKOFF * (2 ** max(attempts - 1, 0)), MAX_BACKOFF)
+
+
+def due_order_ids(limit, now=None):
+    """Ids of pending orders ready for submission, oldest first"""
+    now = now or datetime.utcnow()
+    rows = db.session.query(Order.id).filter(
+        or_(
+            and_(
+                Order.status == 'Pending',
+                Order.fulfillment_attempts < MAX_ATTEMPTS,
+                or_(Order.next_attempt_at.is_(None), Order.next_attempt_at <= now)
+            ),
+            and_(Order.status == 'Processing', Order.claimed_at < now - CLAIM_TIMEOUT)
+        )
+    ).order_by(Order.id).limit(limit).all()
+    return [row[0] for row in rows]
+
+
+def claim_order(order_id, now=None):
+    """Move an order to Processing unless another worker or a cancellation got there first"""
+    now = now or datetime.utcnow()
+    claimed = Order.query.filter(
+        Order.id == order_id,
+        or_(
+            Order.status == 'Pending',
+            and_(Order.status == 'Processing', Order.claimed_at < now - CLAIM_TIMEOUT)
+        )
+    ).update({'status': 'Processing', 'claimed_at': now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def submit_order(provider, order_id):
+    """Send a claimed order to the provider and record the outcome"""
+    order = db.session.get(Order, order_id)
+    if not order or order.status != 'Processing':
+        return False
+
+    service = db.session.get(Service, order.service_id)
+    try:
+        provider_order_id = provider.add_order(
+            service.provider_service_id or service.id, order.link, order.quantity
+        )
+    except ProviderError as e:
+        attempts = order.fulfillment_attempts + 1
+        values = {
+            'status': 'Pending',
+            'fulfillment_attempts': attempts,
+            'claimed_at': None,
+            'last_error': str(e),
+            'next_attempt_at': None
+        }
+        if e.retryable and attempts < MAX_ATTEMPTS:
+            values['next_attempt_at'] = datetime.utcnow() + retry_delay(attempts)
+        else:
+            # Out of the queue; an admin decides whether to retry or refund
+            values['fulfillment_attempts'] = MAX_ATTEMPTS
+        Order.query.filter_by(id=order_id, status='Processing').update(values, synchronize_session=False)
+        db.session.commit()
+        logger.warning('Order %s submission failed (attempt %s): %s', order_id, attempts, e)
+        return False
+
+    Order.query.filter_by(id=order_id, status='Processing').update({
+        'status': 'In Progress',
+        'provider_order_id': provider_order_id,
+        'fulfillment_attempts': order.fulfillment_attempts + 1,
+        'claimed_at': None,
+        'last_error': None,
+        'next_attempt_at': None
+    }, synchronize_session=False)
+    publish_order(order, status='In Progress')
+    db.session.commit()
+    return True
+
+
+class FulfillmentWorker:
+    """Polls the pending-order queue and submits orders through a thread pool"""
+
+    def __init__(self, app, provider, workers=4, batch_size=50, poll_interval=5):
+        self.app = app
+        self.provider = provider
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fulfillment')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _submit(self, order_id):
+        with self.app.app_context():
+            try:
+                return claim_order(order_id) and submit_order(self.provider, order_id)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Order %s fulfillment crashed', order_id)
+                return False
+
+    def run_once(self):
+        """Submit one batch of due orders; returns how many reached the provider"""
+        with self.app.app_context():
+            order_ids = due_order_ids(self.batch_size)
+        return sum(1 for submitted in self._executor.map(self._submit, order_ids) if submitted)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                submitted = self.run_once()
+            except Exception:
+                logger.exception('Fulfillment batch failed')
+                submitted = 0
+            # Drain a backlog without sleeping between full batches
+            if submitted < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='fulfillment-poller', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=True)
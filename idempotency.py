@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, session, jsonify, make_response, Response
+from sqlalchemy.exc import IntegrityError
+from models.user import db, IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = timedelta(hours=24)
+MAX_KEY_LENGTH = 100
+# How long a duplicate waits for the original request before giving up
+WAIT_TIMEOUT = 10
+PURGE_INTERVAL = 60
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_last_purge = [0.0]
+
+
+def _purge_expired(now):
+    if time.monotonic() - _last_purge[0] < PURGE_INTERVAL:
+        return
+    _last_purge[0] = time.monotonic()
+    IdempotencyKey.query.filter(IdempotencyKey.expires_at < now).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _claim(user_id, endpoint, key, request_hash):
+    """Insert the processing marker; returns None if this request won, else the existing row"""
+    now = datetime.utcnow()
+    _purge_expired(now)
+
+    existing = IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+    if existing and existing.expires_at < now:
+        db.session.delete(existing)
+        db.session.commit()
+        existing = None
+    if existing:
+        return existing
+
+    db.session.add(IdempotencyKey(
+        user_id=user_id,
+        endpoint=endpoint,
+        key=key,
+        request_hash=request_hash,
+        status='processing',
+        expires_at=now + IDEMPOTENCY_TTL
+    ))
+    try:
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+        return IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+
+
+def _wait_for(scope, user_id, endpoint, key):
+    """Wait for the original request to finish and return its stored row"""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    delay = 0.05
+    while time.monotonic() < deadline:
+        event = _inflight.get(scope)
+        if event is not None:
+            event.wait(max(deadline - time.monotonic(), 0))
+        else:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        db.session.rollback()
+        row = IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+        if row is None or row.status == 'completed':
+            return row
+    return None
+
+
+def _replay(row):
+    response = Response(row.response_body, status=row.response_status, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Replay the stored response for a repeated Idempotency-Key instead of re-running the view"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or 'user_id' not in session:
+            return view(*args, **kwargs)
+
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters'}), 400
+
+        user_id = session['user_id']
+        endpoint = request.endpoint
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        scope = (user_id, endpoint, key)
+
+        with _inflight_lock:
+            event = _inflight.get(scope)
+            if event is None:
+                event = _inflight[scope] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            row = _wait_for(scope, user_id, endpoint, key)
+        else:
+            try:
+                row = _claim(user_id, endpoint, key, request_hash)
+                if row is None:
+                    return _execute(view, args, kwargs, user_id, endpoint, key)
+            finally:
+                with _inflight_lock:
+                    _inflight.pop(scope, None)
+                event.set()
+
+            if row.status != 'completed':
+                # Claimed by another worker process
+                row = _wait_for(scope, user_id, endpoint, key)
+
+        if row is None or row.status != 'completed':
+            return jsonify({'error': 'A request with this Idempotency-Key is still being processed'}), 409
+        if row.request_hash != request_hash:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used with a different request'}), 422
+        return _replay(row)
+
+    return wrapper
+
+
+def _execute(view, args, kwargs, user_id, endpoint, key):
+    try:
+        response = make_response(view(*args, **kwargs))
+    except Exception:
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).delete()
+        db.session.commit()
+        raise
+
+    row = IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+    if row is not None:
+        if response.status_code >= 500:
+            # Server errors are not final; let the client retry with the same key
+            db.session.delete(row)
+        else:
+            row.status = 'completed'
+            row.response_status = response.status_code
+            row.response_body = response.get_data(as_text=True)
+        db.session.commit()
+    return response
@@ -0,0 +1,63 @@
+import importlib.util
+import os
+
+# Checked once in the web process; uploads are refused up front when it is missing
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+THUMBNAIL_SIZE = (320, 320)
+
+# Leading bytes of the image formats accepted for receipts and attachments
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif')
+]
+
+
+# Formats that can carry EXIF and are re-encoded to drop it (GIFs are left untouched)
+EXIF_FORMATS = {
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG',
+    'image/webp': 'WEBP'
+}
+
+
+def sniff_image_type(head):
+    """Detect the image type from the first bytes of the file, ignoring the client's claim"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def process_image(path, thumbnail_path, content_type):
+    """Strip EXIF metadata in place and write a JPEG thumbnail; runs in a worker process
+
+    Returns (width, height). Raises when Pillow is not installed, so the upload
+    is marked failed instead of being served with its metadata intact.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise RuntimeError('Pillow is required to strip image metadata')
+
+    with Image.open(path) as original:
+        original.load()
+        # Apply the camera rotation before the EXIF block (and any GPS data) is dropped
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+
+        if content_type in EXIF_FORMATS:
+            # Re-encoding without exif= drops the metadata; write-then-rename keeps readers safe
+            image.save(path + '.tmp', format=EXIF_FORMATS[content_type])
+            os.replace(path + '.tmp', path)
+
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+        thumbnail.save(thumbnail_path + '.tmp', format='JPEG', quality=85)
+        os.replace(thumbnail_path + '.tmp', thumbnail_path)
+
+    return width, height
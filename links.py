@@ -0,0 +1,85 @@
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode
+
+# Compiled once: every supported platform URL or a bare @username; the host must end
+# at a path, query, fragment or the end so look-alike hosts and ports do not match
+LINK_PATTERN = re.compile(r'''
+    ^(?:
+        https?://(?:(?:www|m|mobile)\.)?
+        (?P<host>instagram\.com|facebook\.com|youtube\.com|twitter\.com|tiktok\.com)
+        (?=[/?\#]|$)
+        (?P<path>/[^?\#]*)?
+        (?:\?(?P<query>[^\#]*))?
+        (?:\#.*)?
+      |
+        @(?P<username>[A-Za-z0-9_.]+)
+    )$
+''', re.VERBOSE | re.IGNORECASE)
+
+PLATFORMS = {
+    'instagram.com': 'instagram',
+    'facebook.com': 'facebook',
+    'youtube.com': 'youtube',
+    'twitter.com': 'twitter',
+    'tiktok.com': 'tiktok'
+}
+
+# Query parameters that identify the target; everything else (utm_*, igshid, si, fbclid...) is dropped
+SIGNIFICANT_PARAMS = {
+    'youtube': ('v', 'list'),
+    'facebook': ('id', 'story_fbid', 'fbid', 'v')
+}
+
+# First path segments that are routes rather than (case-insensitive) usernames
+RESERVED_SEGMENTS = {
+    'p', 'reel', 'reels', 'tv', 'stories', 'explore', 'watch', 'shorts', 'channel', 'c', 'user',
+    'playlist', 'video', 'videos', 'photo', 'photos', 'posts', 'groups', 'permalink.php',
+    'story.php', 'photo.php', 'profile.php', 'watch.php', 'i', 'hashtag', 'search'
+}
+
+
+class LinkTarget:
+    def __init__(self, platform, canonical):
+        self.platform = platform
+        self.canonical = canonical
+        self.hash = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def canonicalize_link(link):
+    """Return the LinkTarget for a supported link or @username, or None if it is not valid"""
+    match = LINK_PATTERN.match(link.strip())
+    if not match:
+        return None
+
+    if match.group('username'):
+        return LinkTarget('username', '@' + match.group('username').lower().rstrip('.'))
+
+    platform = PLATFORMS[match.group('host').lower()]
+    segments = [segment for segment in (match.group('path') or '').split('/') if segment]
+
+    if segments:
+        first = segments[0]
+        if first.startswith('@') or (platform != 'youtube' and first.lower() not in RESERVED_SEGMENTS):
+            segments[0] = first.lower()
+
+    params = []
+    if match.group('query') and platform in SIGNIFICANT_PARAMS:
+        params = sorted(
+            (name, value) for name, value in parse_qsl(match.group('query'))
+            if name in SIGNIFICANT_PARAMS[platform]
+        )
+
+    # A bare host names no account or post
+    if not segments and not params:
+        return None
+
+    canonical = f"{platform}:/{'/'.join(segments)}"
+    if params:
+        canonical += '?' + urlencode(params)
+    return LinkTarget(platform, canonical)
+
+
+def link_target_hash(link):
+    target = canonicalize_link(link)
+    return target.hash if target else None
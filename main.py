@@ -3,8 +3,20 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import click
+from datetime import timedelta
 from flask import Flask, send_from_directory, jsonify, session
-from src.models.user import db, User, Service, Order, Payment, Ticket, TicketMessage, Notification, SiteSetting
+from src.models.user import db, User, Service, Order, OrderArchive, Payment, Ticket, TicketMessage, Notification, SiteSetting, ServiceStat
+from src.models.popularity import rebuild_service_stats
+from src.models.balance import migrate_legacy_balance
+from src.models.migrations import upgrade_schema
+from src.models.providers import HttpProviderClient
+from src.models.fulfillment import FulfillmentWorker
+from src.models.provider_sync import ProviderSyncEngine
+from src.models.archive import archive_orders
+from src.models.ticket_counters import backfill_ticket_counters
+from src.models.order_targets import backfill_target_hashes
+from src.models.ticket_search import ensure_search_table, rebuild_search_index
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.services import services_bp
@@ -12,6 +24,8 @@ from src.routes.orders import orders_bp
 from src.routes.payments import payments_bp
 from src.routes.tickets import tickets_bp
 from src.routes.admin import admin_bp
+from src.routes.uploads import uploads_bp
+from src.routes.events import events_bp
 from flask_cors import CORS
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
@@ -28,10 +42,15 @@ app.register_blueprint(orders_bp)
 app.register_blueprint(payments_bp)
 app.register_blueprint(tickets_bp)
 app.register_blueprint(admin_bp)
+app.register_blueprint(uploads_bp)
+app.register_blueprint(events_bp)
 
 # إعداد قاعدة البيانات
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# مجلد الملفات المرفوعة (إيصالات الدفع ومرفقات التذاكر)
+app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'database', 'uploads')
 db.init_app(app)
 
 def create_sample_services():
@@ -162,9 +181,77 @@ def create_sample_services():
 with app.app_context():
     db.create_all()
     
+    # نقل الأرصدة القديمة (users.balance) إلى عمود القروش قبل أي استعلام على المستخدمين
+    if migrate_legacy_balance():
+        print("تم نقل الأرصدة إلى عمود balance_minor")
+    
+    # إضافة الأعمدة والفهارس الجديدة للجداول الموجودة (create_all لا يعدّل جدولاً قائماً)
+    applied = upgrade_schema()
+    for migration in applied:
+        print(f"تم تطبيق الترحيل {migration}")
+    
+    # حساب بصمات روابط الطلبات النشطة بعد إضافة عمود target_hash حتى يعمل كشف التكرار
+    if 'migrate_order_targets' in applied:
+        backfill_target_hashes()
+    
     # إنشاء خدمات تجريبية إذا كانت قاعدة البيانات فارغة
     if Service.query.count() == 0:
         create_sample_services()
+    
+    # بناء عدادات شعبية الخدمات من الطلبات السابقة عند أول تشغيل
+    if ServiceStat.query.count() == 0 and Order.query.count() > 0:
+        rebuild_service_stats()
+    
+    # ملء last_message_at للتذاكر القديمة حتى لا تسقط من الترقيم بالمؤشر
+    # (الأعمدة نفسها أضافها upgrade_schema أعلاه)
+    if Ticket.query.filter(Ticket.last_message_at.is_(None)).first() is not None:
+        backfill_ticket_counters()
+    
+    # إنشاء فهرس البحث النصي للتذاكر في قواعد البيانات القديمة وفهرسة التذاكر الموجودة
+    if ensure_search_table() and Ticket.query.count() > 0:
+        rebuild_search_index()
+
+# أرشفة الطلبات المنتهية القديمة: flask --app main archive-orders --days 30
+@app.cli.command('archive-orders')
+@click.option('--days', default=30, help='أرشفة الطلبات المنتهية التي لم تتغير منذ هذا العدد من الأيام')
+def archive_orders_command(days):
+    archived = archive_orders(older_than=timedelta(days=days))
+    print(f"تمت أرشفة {archived} طلب")
+
+# إعادة حساب عدادات رسائل التذاكر: flask --app main backfill-ticket-counters
+@app.cli.command('backfill-ticket-counters')
+def backfill_ticket_counters_command():
+    updated = backfill_ticket_counters()
+    print(f"تم تحديث عدادات {updated} تذكرة")
+
+# حساب بصمات روابط الطلبات النشطة القديمة: flask --app main backfill-order-targets
+@app.cli.command('backfill-order-targets')
+def backfill_order_targets_command():
+    updated = backfill_target_hashes()
+    print(f"تم حساب بصمة الرابط لـ {updated} طلب")
+
+# نقل الأرصدة القديمة يدوياً: flask --app main migrate-balances
+@app.cli.command('migrate-balances')
+def migrate_balances_command():
+    if migrate_legacy_balance():
+        print("تم نقل الأرصدة إلى عمود balance_minor")
+    else:
+        print("عمود balance_minor موجود بالفعل")
+
+# تحديث مخطط قاعدة بيانات قديمة يدوياً: flask --app main upgrade-schema
+@app.cli.command('upgrade-schema')
+def upgrade_schema_command():
+    applied = upgrade_schema()
+    if applied:
+        print("تم تطبيق الترحيلات: " + ", ".join(applied))
+    else:
+        print("قاعدة البيانات محدّثة بالفعل")
+
+# إعادة بناء فهرس البحث في التذاكر: flask --app main rebuild-ticket-search
+@app.cli.command('rebuild-ticket-search')
+def rebuild_ticket_search_command():
+    indexed = rebuild_search_index()
+    print(f"تمت فهرسة {indexed} عنوان ورسالة")
 
 # نقاط النهاية الأساسية
 @app.route('/api/health')
@@ -187,6 +274,8 @@ def api_info():
             'orders': '/api/orders',
             'payments': '/api/payments',
             'tickets': '/api/tickets',
+            'uploads': '/api/uploads',
+            'events': '/api/events',
             'health': '/api/health'
         }
     })
@@ -208,5 +297,22 @@ def serve(path):
             return "index.html not found", 404
 
 if __name__ == '__main__':
+    # تشغيل تنفيذ الطلبات تلقائياً عند إعداد مزود خارجي
+    # وضع debug يشغّل العملية مرتين (المراقب والخادم)، فلا تبدأ الخيوط إلا في عملية الخادم
+    # حتى لا يُرسل الطلب نفسه للمزود مرتين
+    if os.environ.get('PROVIDER_API_URL') and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        provider = HttpProviderClient(os.environ['PROVIDER_API_URL'], os.environ.get('PROVIDER_API_KEY', ''))
+        FulfillmentWorker(
+            app,
+            provider,
+            workers=int(os.environ.get('FULFILLMENT_WORKERS', 4))
+        ).start()
+        # مزامنة حالة الطلبات الجارية مع المزود على دفعات
+        app.extensions['provider_sync'] = ProviderSyncEngine(
+            app,
+            provider,
+            interval=int(os.environ.get('PROVIDER_SYNC_INTERVAL', 300))
+        ).start()
+    
     app.run(host='0.0.0.0', port=5000, debug=True)
 
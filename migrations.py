@@ -0,0 +1,175 @@
+import logging
+from sqlalchemy import text
+from models.user import db, Service, Order, OrderArchive, Payment, Ticket
+
+logger = logging.getLogger(__name__)
+
+# Columns added for automatic fulfillment; ADD COLUMN needs a default for NOT NULL
+SERVICE_PROVIDER_COLUMNS = [
+    ('provider_service_id', 'VARCHAR(64)'),
+]
+ORDER_FULFILLMENT_COLUMNS = [
+    ('provider_order_id', 'VARCHAR(64)'),
+    ('fulfillment_attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('next_attempt_at', 'DATETIME'),
+    ('claimed_at', 'DATETIME'),
+    ('last_error', 'TEXT'),
+]
+ORDER_TARGET_COLUMNS = [
+    ('target_hash', 'VARCHAR(40)'),
+]
+# last_message_at is NOT NULL in the model, but ADD COLUMN cannot default to the current
+# time; it starts NULL and backfill_ticket_counters() fills it from the messages
+TICKET_COUNTER_COLUMNS = [
+    ('message_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('last_message_at', 'DATETIME'),
+    ('last_reply_by_admin', 'BOOLEAN NOT NULL DEFAULT 0'),
+]
+REFUND_COLUMNS = [
+    ('refunded_amount', 'NUMERIC(10, 2) NOT NULL DEFAULT 0'),
+]
+
+
+def table_columns(model):
+    table = model.__table__.name
+    return [row[1] for row in db.session.execute(text(f'PRAGMA table_info("{table}")'))]
+
+
+def add_missing_columns(model, columns):
+    """ALTER TABLE ADD COLUMN for every (name, ddl) the table lacks; returns the added names"""
+    table = model.__table__.name
+    existing = table_columns(model)
+    if not existing:
+        return []
+    added = []
+    for name, ddl in columns:
+        if name not in existing:
+            db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+            added.append(name)
+    return added
+
+
+def table_indexes(model):
+    return set(row[0] for row in db.session.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+        {'table': model.__table__.name}
+    ))
+
+
+# (database, index) pairs seen to exist; indexes are not dropped at runtime, so each is looked up once
+_confirmed_indexes = set()
+
+
+def index_exists(model, name):
+    """True once the named index exists; until then callers keep their own checks"""
+    key = (str(db.engine.url), name)
+    if key not in _confirmed_indexes and name in table_indexes(model):
+        _confirmed_indexes.add(key)
+    return key in _confirmed_indexes
+
+
+def create_missing_indexes(model, unique=False):
+    """Create the model's declared indexes on a table that predates them
+
+    create_all() skips tables that already exist, indexes included. Indexes
+    over columns the table still lacks are left to the migration adding them,
+    and unique ones only go in with unique=True once duplicates are resolved.
+    """
+    columns = set(table_columns(model))
+    existing = table_indexes(model)
+    created = []
+    for index in sorted(model.__table__.indexes, key=lambda index: index.name):
+        if index.name in existing or (index.unique and not unique):
+            continue
+        if all(column.name in columns for column in index.columns):
+            index.create(db.session.connection())
+            created.append(index.name)
+    return created
+
+
+def migrate_fulfillment_columns():
+    """Add the provider columns to service and order; True when the schema changed"""
+    changed = add_missing_columns(Service, SERVICE_PROVIDER_COLUMNS)
+    changed += add_missing_columns(Order, ORDER_FULFILLMENT_COLUMNS)
+    changed += create_missing_indexes(Service) + create_missing_indexes(Order)
+    db.session.commit()
+    return bool(changed)
+
+
+def migrate_order_targets():
+    """Add order.target_hash and idx_order_target; the hashes come from backfill_target_hashes()"""
+    changed = add_missing_columns(Order, ORDER_TARGET_COLUMNS) + create_missing_indexes(Order)
+    db.session.commit()
+    return bool(changed)
+
+
+def migrate_refund_columns():
+    """Record what each order already refunded; True when the schema changed
+
+    Cancelled and Refunded orders were refunded in full; Partial orders synced
+    from the provider were refunded the share of the remains.
+    """
+    changed = False
+    for model in (Order, OrderArchive):
+        if not add_missing_columns(model, REFUND_COLUMNS):
+            continue
+        table = model.__table__.name
+        db.session.execute(text(
+            f"UPDATE \"{table}\" SET refunded_amount = charge WHERE status IN ('Cancelled', 'Refunded')"
+        ))
+        db.session.execute(text(
+            f"UPDATE \"{table}\" SET refunded_amount = ROUND(CAST(charge AS REAL) * remains / quantity, 2) "
+            "WHERE status = 'Partial' AND provider_order_id IS NOT NULL AND quantity > 0"
+        ))
+        changed = True
+    db.session.commit()
+    return changed
+
+
+def migrate_ticket_counters():
+    """Add the ticket counter columns and their indexes; the values come from backfill_ticket_counters()"""
+    changed = add_missing_columns(Ticket, TICKET_COUNTER_COLUMNS) + create_missing_indexes(Ticket)
+    db.session.commit()
+    return bool(changed)
+
+
+def payment_transaction_duplicates():
+    """(payment_method, transaction_id, count) for transaction ids submitted more than once"""
+    return db.session.query(
+        Payment.payment_method, Payment.transaction_id, db.func.count(Payment.id)
+    ).group_by(Payment.payment_method, Payment.transaction_id).having(db.func.count(Payment.id) > 1).all()
+
+
+def migrate_payment_transaction_index():
+    """Create uq_payment_transaction once no duplicate transaction ids are left
+
+    Duplicates may already have been approved and credited, so they are only
+    reported for an admin to resolve; create_payment keeps its pre-check until
+    the index exists.
+    """
+    if index_exists(Payment, 'uq_payment_transaction'):
+        return False
+    duplicates = payment_transaction_duplicates()
+    if duplicates:
+        for payment_method, transaction_id, count in duplicates:
+            logger.warning('Transaction %s (%s) was submitted %s times', transaction_id, payment_method, count)
+        logger.warning('uq_payment_transaction not created: %s duplicate transaction ids', len(duplicates))
+        return False
+    changed = create_missing_indexes(Payment, unique=True)
+    db.session.commit()
+    return bool(changed)
+
+
+# Run in order at startup, right after create_all() and before any query on these tables
+MIGRATIONS = [
+    migrate_fulfillment_columns,
+    migrate_order_targets,
+    migrate_refund_columns,
+    migrate_ticket_counters,
+    migrate_payment_transaction_index,
+]
+
+
+def upgrade_schema():
+    """Bring a database created by an older version up to the models; returns the migrations applied"""
+    return [migration.__name__ for migration in MIGRATIONS if migration()]
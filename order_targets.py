@@ -0,0 +1,50 @@
+from sqlalchemy import bindparam, update
+from models.user import db, Order
+from models.links import link_target_hash
+
+# Orders in these statuses block a second order on the same target
+ACTIVE_ORDER_STATUSES = ['Pending', 'Processing', 'In Progress']
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_target_hashes(batch_size=BACKFILL_BATCH_SIZE):
+    """Fill target_hash for active orders placed before it existed; returns the number updated
+
+    Walks the active orders without a hash in id order, one short transaction
+    per batch. Links that no longer canonicalize keep a NULL hash.
+    """
+    orders = Order.__table__
+    stmt = (
+        update(orders)
+        .where(orders.c.id == bindparam('order_id'))
+        .values(target_hash=bindparam('new_target_hash'))
+    )
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(Order.id, Order.link)
+            .filter(
+                Order.id > last_id,
+                Order.target_hash.is_(None),
+                Order.status.in_(ACTIVE_ORDER_STATUSES)
+            )
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        params = []
+        for row in rows:
+            target_hash = link_target_hash(row.link or '')
+            if target_hash:
+                params.append({'order_id': row.id, 'new_target_hash': target_hash})
+        if params:
+            db.session.execute(stmt, params)
+            updated += len(params)
+        db.session.commit()
+    return updated
@@ -1,22 +1,59 @@
 from flask import Blueprint, request, jsonify, session
-from models.user import db, Order, Service, User
+from models.user import db, Order, OrderArchive, Service, User
+from models.idempotency import idempotent
+from models.stats import order_stats
+from models.pagination import paginate, InvalidCursor
+from models.popularity import record_order, record_orders
+from models.balance import debit, credit, round_amount
+from models.links import canonicalize_link, link_target_hash
+from models.order_targets import ACTIVE_ORDER_STATUSES
+from models.archive import find_order
+from models.export import EXPORT_FORMATS, order_export_queries, parse_export_date, export_response
+from models.event_bus import order_payload, publish_order, publish_orders
+from sqlalchemy.orm import joinedload
 from datetime import datetime
-import re
 
 orders_bp = Blueprint('orders', __name__, url_prefix='/api/orders')
 
+MAX_MASS_ORDER_LINES = 500
+
 def validate_url(url):
     """Validate if URL is a valid social media URL"""
-    patterns = [
-        r'https?://(www\.)?(instagram\.com|facebook\.com|youtube\.com|twitter\.com|tiktok\.com)',
-        r'https?://(www\.)?(instagram\.com|facebook\.com|youtube\.com|twitter\.com|tiktok\.com)/.*',
-        r'@[a-zA-Z0-9_.]+',  # Username format
-    ]
+    return canonicalize_link(url) is not None
+
+def active_targets(pairs):
+    """Return the (service_id, target_hash) pairs that already have an active order"""
+    pairs = set(pairs)
+    if not pairs:
+        return set()
+    
+    rows = db.session.query(Order.service_id, Order.target_hash).filter(
+        Order.target_hash.in_(set(target_hash for service_id, target_hash in pairs)),
+        Order.status.in_(ACTIVE_ORDER_STATUSES)
+    ).all()
+    return set((service_id, target_hash) for service_id, target_hash in rows) & pairs
+
+def validate_order(service, quantity, link):
+    """Return an error message if the order cannot be placed, otherwise None"""
+    error = service.validate_quantity(quantity)
+    if error:
+        return error
+    
+    if not validate_url(link):
+        return 'Invalid URL or username format'
+    
+    return None
+
+def parse_mass_order_line(line):
+    """Parse a 'service_id|link|quantity' line into its fields"""
+    parts = [part.strip() for part in line.split('|')]
+    if len(parts) != 3 or not all(parts):
+        raise ValueError('Line must be in the format service_id|link|quantity')
     
-    for pattern in patterns:
-        if re.match(pattern, url):
-            return True
-    return False
+    try:
+        return int(parts[0]), parts[1], int(parts[2])
+    except ValueError:
+        raise ValueError('Service ID and quantity must be numbers')
 
 @orders_bp.route('/', methods=['GET'])
 def get_orders():
@@ -25,34 +62,56 @@ def get_orders():
             return jsonify({'error': 'Not authenticated'}), 401
         
         user_id = session['user_id']
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
         status = request.args.get('status')
+        # ?archived=1 lists old finished orders moved out of the live table
+        model = OrderArchive if request.args.get('archived') in ('1', 'true') else Order
         
-        # Build query
-        query = Order.query.filter_by(user_id=user_id)
+        # Build query (service name joined in, not lazy-loaded per row)
+        query = model.query.filter_by(user_id=user_id).options(
+            joinedload(model.service).load_only(Service.name)
+        )
         
         if status:
-            query = query.filter(Order.status == status)
+            query = query.filter(model.status == status)
         
         # Order by creation date (newest first)
-        query = query.order_by(Order.created_at.desc())
+        query = query.order_by(model.created_at.desc())
         
         # Paginate results
-        orders = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        orders = paginate(query, model, default_per_page=10)
         
         return jsonify({
             'orders': [order.to_dict() for order in orders.items],
-            'total': orders.total,
-            'pages': orders.pages,
-            'current_page': page,
-            'per_page': per_page
+            **orders.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@orders_bp.route('/export', methods=['GET'])
+def export_orders():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'format must be csv or ndjson'}), 400
+        
+        statements = order_export_queries(
+            user_id=session['user_id'],
+            status=request.args.get('status'),
+            start=parse_export_date(request.args.get('from'), 'from'),
+            end=parse_export_date(request.args.get('to'), 'to')
+        )
+        
+        # Rows are streamed in batches; the full history is never loaded at once
+        return export_response(statements, fmt, 'orders')
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -64,7 +123,8 @@ def get_order(order_id):
         
         user_id = session['user_id']
         
-        order = Order.query.filter_by(id=order_id, user_id=user_id).first()
+        # Old finished orders live in the archive table
+        order = find_order(order_id, user_id=user_id)
         if not order:
             return jsonify({'error': 'Order not found'}), 404
         
@@ -74,6 +134,7 @@ def get_order(order_id):
         return jsonify({'error': str(e)}), 500
 
 @orders_bp.route('/', methods=['POST'])
+@idempotent
 def create_order():
     try:
         if 'user_id' not in session:
@@ -97,29 +158,24 @@ def create_order():
         if not service:
             return jsonify({'error': 'Service not found'}), 404
         
-        if not service.is_active:
-            return jsonify({'error': 'Service is not available'}), 400
-        
-        # Validate quantity
-        if quantity < service.min_quantity:
-            return jsonify({'error': f'Minimum quantity is {service.min_quantity}'}), 400
-        
-        if quantity > service.max_quantity:
-            return jsonify({'error': f'Maximum quantity is {service.max_quantity}'}), 400
+        # Validate availability, quantity and URL/link
+        error = validate_order(service, quantity, link)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Validate URL/link
-        if not validate_url(link):
-            return jsonify({'error': 'Invalid URL or username format'}), 400
+        # Reject a second active order on the same target for this service
+        target_hash = link_target_hash(link)
+        if active_targets([(service.id, target_hash)]):
+            return jsonify({'error': 'An active order for this link already exists'}), 400
         
         # Calculate price
-        total_price = (quantity / 1000) * float(service.price_per_1000)
+        total_price = round_amount(service.calculate_price(quantity))
         
-        # Get user and check balance
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        if float(user.balance) < total_price:
+        # Deduct balance with a single conditional UPDATE
+        if not debit(user_id, total_price):
+            db.session.rollback()
+            if not User.query.get(user_id):
+                return jsonify({'error': 'User not found'}), 404
             return jsonify({'error': 'Insufficient balance'}), 400
         
         # Create order
@@ -127,16 +183,17 @@ def create_order():
             user_id=user_id,
             service_id=service_id,
             link=link,
+            target_hash=target_hash,
             quantity=quantity,
             charge=total_price,
             remains=quantity,
             status='Pending'
         )
         
-        # Deduct balance
-        user.balance = float(user.balance) - total_price
-        
         db.session.add(order)
+        record_order(service_id)
+        db.session.flush()
+        publish_order(order)
         db.session.commit()
         
         return jsonify({
@@ -148,30 +205,145 @@ def create_order():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@orders_bp.route('/stats', methods=['GET'])
-def get_order_stats():
+@orders_bp.route('/mass', methods=['POST'])
+@idempotent
+def create_mass_order():
     try:
         if 'user_id' not in session:
             return jsonify({'error': 'Not authenticated'}), 401
         
+        data = request.get_json() or {}
         user_id = session['user_id']
         
-        # Get order statistics
-        total_orders = Order.query.filter_by(user_id=user_id).count()
-        pending_orders = Order.query.filter_by(user_id=user_id, status='Pending').count()
-        in_progress_orders = Order.query.filter_by(user_id=user_id, status='In Progress').count()
-        completed_orders = Order.query.filter_by(user_id=user_id, status='Completed').count()
+        # Accept either pasted text or a list of lines
+        lines = data.get('orders')
+        if isinstance(lines, str):
+            lines = lines.splitlines()
+        if not isinstance(lines, list):
+            return jsonify({'error': 'orders is required'}), 400
+        
+        # Keep the pasted line numbers so results point at the right line
+        lines = [
+            (number, line.strip())
+            for number, line in enumerate(lines, 1)
+            if isinstance(line, str) and line.strip()
+        ]
+        if not lines:
+            return jsonify({'error': 'orders is required'}), 400
+        
+        if len(lines) > MAX_MASS_ORDER_LINES:
+            return jsonify({'error': f'A mass order can contain at most {MAX_MASS_ORDER_LINES} lines'}), 400
+        
+        results = []
+        for number, line in lines:
+            result = {'line': number, 'input': line}
+            try:
+                result['service_id'], result['link'], result['quantity'] = parse_mass_order_line(line)
+            except ValueError as e:
+                result['error'] = str(e)
+            results.append(result)
+        
+        # Load every referenced service in one query
+        service_ids = set(result['service_id'] for result in results if 'error' not in result)
+        services = {}
+        if service_ids:
+            services = {
+                service.id: service
+                for service in Service.query.filter(Service.id.in_(service_ids)).all()
+            }
+        
+        orders = []
+        seen_targets = set()
+        total_price = 0
+        for result in results:
+            if 'error' in result:
+                continue
+            
+            service = services.get(result['service_id'])
+            if not service:
+                result['error'] = 'Service not found'
+                continue
+            
+            error = validate_order(service, result['quantity'], result['link'])
+            if error:
+                result['error'] = error
+                continue
+            
+            target_hash = link_target_hash(result['link'])
+            if (service.id, target_hash) in seen_targets:
+                result['error'] = 'Duplicate link for this service in the same batch'
+                continue
+            seen_targets.add((service.id, target_hash))
+            
+            charge = round_amount(service.calculate_price(result['quantity']))
+            total_price += charge
+            orders.append((result, Order(
+                user_id=user_id,
+                service_id=service.id,
+                link=result['link'],
+                target_hash=target_hash,
+                quantity=result['quantity'],
+                charge=charge,
+                remains=result['quantity'],
+                status='Pending'
+            )))
+        
+        # One indexed lookup for every target that already has an active order
+        duplicates = active_targets((order.service_id, order.target_hash) for result, order in orders)
+        if duplicates:
+            for result, order in orders:
+                if (order.service_id, order.target_hash) in duplicates:
+                    result['error'] = 'An active order for this link already exists'
+            orders = [(result, order) for result, order in orders if 'error' not in result]
+            total_price = sum(order.charge for result, order in orders)
+        
+        if not orders:
+            return jsonify({'error': 'No valid orders', 'results': results}), 400
+        
+        # Deduct the whole batch with one conditional UPDATE
+        if not debit(user_id, total_price):
+            db.session.rollback()
+            return jsonify({'error': 'Insufficient balance', 'total_price': float(total_price), 'results': results}), 400
+        
+        db.session.add_all([order for result, order in orders])
+        
+        order_counts = {}
+        for result, order in orders:
+            order_counts[order.service_id] = order_counts.get(order.service_id, 0) + 1
+        record_orders(order_counts)
+        
+        db.session.flush()
+        for result, order in orders:
+            result['order_id'] = order.id
+            result['charge'] = float(order.charge)
+        publish_orders({user_id: [
+            order_payload(order.id, order.status, order.remains, order.start_count) for result, order in orders
+        ]})
         
-        # Calculate total spent
-        total_spent = db.session.query(db.func.sum(Order.charge)).filter_by(user_id=user_id).scalar() or 0
+        db.session.commit()
         
         return jsonify({
-            'total_orders': total_orders,
-            'pending_orders': pending_orders,
-            'in_progress_orders': in_progress_orders,
-            'completed_orders': completed_orders,
-            'total_spent': float(total_spent)
-        }), 200
+            'message': f'{len(orders)} orders created successfully',
+            'created_count': len(orders),
+            'error_count': len(results) - len(orders),
+            'total_price': float(total_price),
+            'results': results
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@orders_bp.route('/stats', methods=['GET'])
+def get_order_stats():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        user_id = session['user_id']
+        
+        # All status counts and the total spent in one GROUP BY query
+        return jsonify(order_stats(user_id)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -192,13 +364,18 @@ def cancel_order(order_id):
         if order.status != 'Pending':
             return jsonify({'error': 'Only pending orders can be cancelled'}), 400
         
-        # Refund balance
-        user = User.query.get(user_id)
-        user.balance = float(user.balance) + float(order.charge)
+        # Update order status only if it is still pending, so a refund happens once
+        cancelled = Order.query.filter_by(id=order_id, status='Pending').update(
+            {'status': 'Cancelled', 'refunded_amount': Order.charge, 'updated_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        if not cancelled:
+            db.session.rollback()
+            return jsonify({'error': 'Only pending orders can be cancelled'}), 400
         
-        # Update order status
-        order.status = 'Cancelled'
-        order.updated_at = datetime.utcnow()
+        # Refund balance
+        credit(user_id, order.charge)
+        publish_order(order, status='Cancelled')
         
         db.session.commit()
         
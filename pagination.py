@@ -0,0 +1,108 @@
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import tuple_
+
+MAX_PER_PAGE = 100
+# total=estimate stops counting here instead of scanning every matching row
+ESTIMATE_COUNT_LIMIT = 10000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id, direction='next'):
+    # A NULL sort value cannot be compared in the keyset filter, so it never becomes a cursor
+    if created_at is None:
+        raise ValueError('Cursor sort value must not be NULL')
+    payload = json.dumps([created_at.isoformat(), row_id, direction])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id, direction = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return datetime.fromisoformat(created_at), int(row_id), direction
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+class Page:
+    def __init__(self, items, meta):
+        self.items = items
+        self.meta = meta
+
+
+def paginate(query, model, default_per_page=20, sort_column=None):
+    """Paginate a list query using the page/per_page or cursor request arguments
+
+    Offset mode (the default) keeps the original page/total response. Passing
+    cursor=<opaque> or pagination=cursor switches to keyset pagination over
+    (sort_column, id), newest first, so deep pages cost the same as the first.
+    sort_column defaults to created_at and must be a non-null datetime column.
+    """
+    if sort_column is None:
+        sort_column = model.created_at
+    sort_key = sort_column.key
+    per_page = min(max(int(request.args.get('per_page', default_per_page)), 1), MAX_PER_PAGE)
+    cursor = request.args.get('cursor')
+
+    if not cursor and request.args.get('pagination') != 'cursor':
+        page = int(request.args.get('page', 1))
+        result = query.paginate(page=page, per_page=per_page, error_out=False)
+        return Page(result.items, {
+            'total': result.total,
+            'pages': result.pages,
+            'current_page': page,
+            'per_page': per_page
+        })
+
+    key = tuple_(sort_column, model.id)
+    keyset = query.order_by(None)
+    direction = 'next'
+
+    if cursor:
+        created_at, row_id, direction = decode_cursor(cursor)
+        if direction == 'next':
+            keyset = keyset.filter(key < tuple_(created_at, row_id))
+        else:
+            keyset = keyset.filter(key > tuple_(created_at, row_id))
+
+    if direction == 'next':
+        keyset = keyset.order_by(sort_column.desc(), model.id.desc())
+    else:
+        keyset = keyset.order_by(sort_column.asc(), model.id.asc())
+
+    rows = keyset.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+
+    if direction == 'next':
+        next_cursor = encode_cursor(getattr(items[-1], sort_key), items[-1].id) if has_more else None
+        prev_cursor = encode_cursor(getattr(items[0], sort_key), items[0].id, 'prev') if cursor and items else None
+    else:
+        items.reverse()
+        prev_cursor = encode_cursor(getattr(items[0], sort_key), items[0].id, 'prev') if has_more else None
+        next_cursor = encode_cursor(getattr(items[-1], sort_key), items[-1].id) if items else None
+
+    meta = {
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'per_page': per_page
+    }
+
+    total = request.args.get('total')
+    if total == 'exact':
+        meta['total'] = query.order_by(None).count()
+    elif total == 'estimate':
+        # Count at most ESTIMATE_COUNT_LIMIT matching rows; beyond that the total is a lower bound
+        counted = query.order_by(None).limit(ESTIMATE_COUNT_LIMIT).count()
+        meta['total'] = counted
+        meta['total_is_estimate'] = counted >= ESTIMATE_COUNT_LIMIT
+
+    return Page(items, meta)
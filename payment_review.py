@@ -0,0 +1,55 @@
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import update
+from models.user import db, Payment
+from models.balance import credit
+from models.event_bus import publish_after_commit
+
+# Admin action -> final payment status
+REVIEW_ACTIONS = {
+    'approve': 'Approved',
+    'reject': 'Rejected'
+}
+MAX_REVIEW_BATCH = 500
+
+
+def review_payments(payment_ids, action, notes=''):
+    """Approve or reject pending payments; returns one outcome per id, in input order
+
+    The conditional UPDATE ... RETURNING only moves rows that are still Pending,
+    so a payment reviewed twice (or by two admins at once) is credited once.
+    Approved amounts are credited with one UPDATE per user. The caller commits.
+    """
+    status = REVIEW_ACTIONS[action]
+    payments = Payment.__table__
+    rows = db.session.execute(
+        update(payments)
+        .where(payments.c.id.in_(payment_ids), payments.c.status == 'Pending')
+        .values(status=status, notes=notes, updated_at=datetime.utcnow())
+        .returning(payments.c.id, payments.c.user_id, payments.c.amount)
+    ).all()
+    reviewed = set(row.id for row in rows)
+    for row in rows:
+        publish_after_commit(row.user_id, 'payment', {'payment_id': row.id, 'status': status})
+
+    if status == 'Approved':
+        totals = {}
+        for row in rows:
+            totals[row.user_id] = totals.get(row.user_id, Decimal(0)) + Decimal(row.amount)
+        for user_id, amount in totals.items():
+            credit(user_id, amount)
+
+    skipped = [payment_id for payment_id in payment_ids if payment_id not in reviewed]
+    existing = set()
+    if skipped:
+        existing = set(row[0] for row in db.session.query(Payment.id).filter(Payment.id.in_(skipped)))
+
+    results = []
+    for payment_id in payment_ids:
+        if payment_id in reviewed:
+            results.append({'payment_id': payment_id, 'status': status})
+        elif payment_id in existing:
+            results.append({'payment_id': payment_id, 'error': 'Payment is not pending'})
+        else:
+            results.append({'payment_id': payment_id, 'error': 'Payment not found'})
+    return results
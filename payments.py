@@ -1,6 +1,12 @@
 from flask import Blueprint, request, jsonify, session
-from models.user import db, Payment, User
-from datetime import datetime
+from models.user import db, Payment, Upload
+from models.idempotency import idempotent
+from models.stats import payment_stats
+from models.pagination import paginate, InvalidCursor
+from models.site_settings import payment_methods, payment_method as get_payment_method
+from models.event_bus import publish_after_commit
+from models.migrations import index_exists
+from sqlalchemy.exc import IntegrityError
 import re
 
 payments_bp = Blueprint('payments', __name__, url_prefix='/api/payments')
@@ -17,8 +23,6 @@ def get_payments():
             return jsonify({'error': 'Not authenticated'}), 401
         
         user_id = session['user_id']
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
         status = request.args.get('status')
         
         # Build query
@@ -31,24 +35,20 @@ def get_payments():
         query = query.order_by(Payment.created_at.desc())
         
         # Paginate results
-        payments = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        payments = paginate(query, Payment, default_per_page=10)
         
         return jsonify({
             'payments': [payment.to_dict() for payment in payments.items],
-            'total': payments.total,
-            'pages': payments.pages,
-            'current_page': page,
-            'per_page': per_page
+            **payments.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @payments_bp.route('/', methods=['POST'])
+@idempotent
 def create_payment():
     try:
         if 'user_id' not in session:
@@ -76,23 +76,25 @@ def create_payment():
         if amount > 10000:
             return jsonify({'error': 'Maximum deposit amount is 10,000 EGP'}), 400
         
-        # Validate payment method
-        valid_methods = ['Vodafone Cash', 'Orange Money', 'Etisalat Cash', 'Bank Transfer', 'InstaPay']
-        if payment_method not in valid_methods:
+        # Validate payment method (configured in site settings)
+        method = get_payment_method(payment_method)
+        if not method:
             return jsonify({'error': 'Invalid payment method'}), 400
         
         # Validate phone number for mobile wallet payments
-        if payment_method in ['Vodafone Cash', 'Orange Money', 'Etisalat Cash']:
+        if method.get('requires_phone'):
             if not phone_number:
                 return jsonify({'error': 'Phone number is required for mobile wallet payments'}), 400
             
             if not validate_phone_number(phone_number):
                 return jsonify({'error': 'Invalid Egyptian phone number format'}), 400
         
-        # Check for duplicate transaction ID
-        existing_payment = Payment.query.filter_by(transaction_id=transaction_id).first()
-        if existing_payment:
-            return jsonify({'error': 'Transaction ID already exists'}), 400
+        # Receipt image uploaded beforehand through /api/uploads
+        receipt = None
+        if data.get('receipt_upload_id') is not None:
+            receipt = Upload.query.filter_by(id=data['receipt_upload_id'], user_id=user_id).first()
+            if not receipt:
+                return jsonify({'error': 'Receipt upload not found'}), 400
         
         # Create payment request
         payment = Payment(
@@ -101,10 +103,26 @@ def create_payment():
             payment_method=payment_method,
             transaction_id=transaction_id,
             status='Pending',
-            notes=notes
+            notes=notes,
+            receipt_image=receipt.url if receipt else None
         )
         
+        # Duplicate transaction IDs are rejected by the unique index; databases still
+        # waiting for it (see migrate_payment_transaction_index) need the pre-check
+        if not index_exists(Payment, 'uq_payment_transaction'):
+            if Payment.query.filter_by(payment_method=payment_method, transaction_id=transaction_id).first():
+                return jsonify({'error': 'Transaction ID already exists'}), 400
+        
         db.session.add(payment)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            # Only a row with the same (payment_method, transaction_id) makes this a duplicate
+            if Payment.query.filter_by(payment_method=payment_method, transaction_id=transaction_id).first():
+                return jsonify({'error': 'Transaction ID already exists'}), 400
+            raise
+        publish_after_commit(user_id, 'payment', {'payment_id': payment.id, 'status': payment.status})
         db.session.commit()
         
         return jsonify({
@@ -119,45 +137,8 @@ def create_payment():
 @payments_bp.route('/methods', methods=['GET'])
 def get_payment_methods():
     try:
-        methods = [
-            {
-                'id': 'vodafone_cash',
-                'name': 'Vodafone Cash',
-                'icon': 'smartphone',
-                'instructions': 'قم بالتحويل إلى رقم: 01012345678 ثم أرسل رقم العملية',
-                'requires_phone': True
-            },
-            {
-                'id': 'orange_money',
-                'name': 'Orange Money',
-                'icon': 'smartphone',
-                'instructions': 'قم بالتحويل إلى رقم: 01112345678 ثم أرسل رقم العملية',
-                'requires_phone': True
-            },
-            {
-                'id': 'etisalat_cash',
-                'name': 'Etisalat Cash',
-                'icon': 'smartphone',
-                'instructions': 'قم بالتحويل إلى رقم: 01512345678 ثم أرسل رقم العملية',
-                'requires_phone': True
-            },
-            {
-                'id': 'bank_transfer',
-                'name': 'Bank Transfer',
-                'icon': 'building-bank',
-                'instructions': 'قم بالتحويل إلى حساب: 1234567890 - البنك الأهلي المصري',
-                'requires_phone': False
-            },
-            {
-                'id': 'instapay',
-                'name': 'InstaPay',
-                'icon': 'credit-card',
-                'instructions': 'قم بالتحويل عبر InstaPay إلى: sniper.server@instapay.com',
-                'requires_phone': False
-            }
-        ]
-        
-        return jsonify({'methods': methods}), 200
+        # Served from the process-wide settings cache
+        return jsonify({'methods': payment_methods()}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -170,29 +151,8 @@ def get_payment_stats():
         
         user_id = session['user_id']
         
-        # Get payment statistics
-        total_deposits = db.session.query(db.func.sum(Payment.amount)).filter_by(
-            user_id=user_id, status='Approved'
-        ).scalar() or 0
-        
-        pending_deposits = db.session.query(db.func.sum(Payment.amount)).filter_by(
-            user_id=user_id, status='Pending'
-        ).scalar() or 0
-        
-        total_payments = Payment.query.filter_by(user_id=user_id).count()
-        approved_payments = Payment.query.filter_by(user_id=user_id, status='Approved').count()
-        
-        # Get current balance
-        user = User.query.get(user_id)
-        current_balance = float(user.balance) if user else 0
-        
-        return jsonify({
-            'total_deposits': float(total_deposits),
-            'pending_deposits': float(pending_deposits),
-            'current_balance': current_balance,
-            'total_payments': total_payments,
-            'approved_payments': approved_payments
-        }), 200
+        # Deposit sums and counts in one GROUP BY query plus the balance lookup
+        return jsonify(payment_stats(user_id)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,115 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.user import db, Order, ServiceStat
+from models.catalog_cache import catalog_cache, POPULAR_LIMIT
+
+# Each order adds 2^((t - EPOCH) / HALF_LIFE) to the service score. All scores
+# share the same decay factor, so ordering by the stored sum ranks services by
+# their exponentially decayed (rolling window) order volume. Scores overflow a
+# float after ~1000 half-lives, so move the epoch forward and rebuild long before.
+POPULARITY_EPOCH = datetime(2025, 1, 1)
+POPULARITY_HALF_LIFE = timedelta(days=7)
+RANKING_REFRESH_SECONDS = 60
+RANKING_SIZE = 50
+
+
+def order_weight(ordered_at=None):
+    elapsed = (ordered_at or datetime.utcnow()) - POPULARITY_EPOCH
+    return 2.0 ** (elapsed.total_seconds() / POPULARITY_HALF_LIFE.total_seconds())
+
+
+def record_orders(order_counts, ordered_at=None):
+    """Add orders to the per-service counters inside the current transaction"""
+    ordered_at = ordered_at or datetime.utcnow()
+    weight = order_weight(ordered_at)
+
+    for service_id, count in order_counts.items():
+        stmt = sqlite_insert(ServiceStat).values(
+            service_id=service_id,
+            order_count=count,
+            popularity_score=weight * count,
+            last_ordered_at=ordered_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ServiceStat.service_id],
+            set_={
+                'order_count': ServiceStat.order_count + stmt.excluded.order_count,
+                'popularity_score': ServiceStat.popularity_score + stmt.excluded.popularity_score,
+                'last_ordered_at': stmt.excluded.last_ordered_at
+            }
+        )
+        db.session.execute(stmt)
+
+
+def record_order(service_id, ordered_at=None):
+    record_orders({service_id: 1}, ordered_at)
+
+
+def rebuild_service_stats():
+    """Recompute every service counter from the orders table"""
+    stats = {}
+    rows = db.session.query(Order.service_id, Order.created_at).execution_options(yield_per=1000)
+    for service_id, created_at in rows:
+        stat = stats.setdefault(service_id, {'order_count': 0, 'popularity_score': 0.0, 'last_ordered_at': None})
+        stat['order_count'] += 1
+        stat['popularity_score'] += order_weight(created_at)
+        if created_at and (stat['last_ordered_at'] is None or created_at > stat['last_ordered_at']):
+            stat['last_ordered_at'] = created_at
+
+    ServiceStat.query.delete()
+    db.session.add_all([ServiceStat(service_id=service_id, **stat) for service_id, stat in stats.items()])
+    db.session.commit()
+    popularity_ranking.invalidate()
+    return len(stats)
+
+
+class PopularityRanking:
+    """Top-N services by popularity score, re-read at most once per refresh interval"""
+
+    def __init__(self, refresh_seconds=RANKING_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._service_ids = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        self._service_ids = None
+
+    def _ranked_ids(self):
+        service_ids = self._service_ids
+        if service_ids is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return service_ids
+
+        with self._lock:
+            if self._service_ids is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+                # Keep more ids than any page shows so inactive services can be skipped
+                rows = db.session.query(ServiceStat.service_id).order_by(
+                    ServiceStat.popularity_score.desc()
+                ).limit(RANKING_SIZE).all()
+                self._service_ids = [row[0] for row in rows]
+                self._loaded_at = time.monotonic()
+            return self._service_ids
+
+    def top(self, limit=POPULAR_LIMIT):
+        services = []
+        for service_id in self._ranked_ids():
+            service = catalog_cache.get(service_id)
+            if service and service['is_active']:
+                services.append(service)
+                if len(services) == limit:
+                    return services
+
+        # Pad with catalog order until enough services have been ordered
+        ranked_ids = set(service['id'] for service in services)
+        for service in catalog_cache.popular(limit + len(services)):
+            if service['id'] not in ranked_ids:
+                services.append(service)
+                if len(services) == limit:
+                    break
+        return services
+
+
+popularity_ranking = PopularityRanking()
+
@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import update
+from models.user import db, Order
+from models.providers import ProviderError, MAX_STATUS_BATCH
+from models.balance import credit, round_amount
+from models.event_bus import order_payload, publish_orders
+
+logger = logging.getLogger(__name__)
+
+# Provider status (lower-cased) -> local order status
+STATUS_MAP = {
+    'pending': 'In Progress',
+    'processing': 'In Progress',
+    'in progress': 'In Progress',
+    'completed': 'Completed',
+    'partial': 'Partial',
+    'canceled': 'Cancelled',
+    'cancelled': 'Cancelled'
+}
+
+
+class RateLimiter:
+    """Token bucket limiting provider calls per second across threads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SyncMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sweeps = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.orders_checked = 0
+        self.orders_updated = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.last_sweep_at = None
+
+    def record_batch(self, latency, checked, failed=False):
+        with self._lock:
+            self.batches += 1
+            self.failed_batches += 1 if failed else 0
+            self.orders_checked += checked
+            self.total_latency += latency
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_updates(self, updated):
+        with self._lock:
+            self.orders_updated += updated
+
+    def record_sweep(self):
+        with self._lock:
+            self.sweeps += 1
+            self.last_sweep_at = datetime.utcnow()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'sweeps': self.sweeps,
+                'batches': self.batches,
+                'failed_batches': self.failed_batches,
+                'orders_checked': self.orders_checked,
+                'orders_updated': self.orders_updated,
+                'avg_batch_latency_ms': round(self.total_latency / self.batches * 1000, 1) if self.batches else 0.0,
+                'max_batch_latency_ms': round(self.max_latency * 1000, 1),
+                'last_batch_latency_ms': round(self.last_latency * 1000, 1),
+                'last_sweep_at': self.last_sweep_at.isoformat() if self.last_sweep_at else None
+            }
+
+
+def _as_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def plan_changes(rows, statuses):
+    """Compare local rows with provider statuses; split plain progress from terminal changes"""
+    progress = []
+    terminal = []
+    for row in rows:
+        status = statuses.get(str(row.provider_order_id))
+        if not status or status.get('error'):
+            continue
+
+        new_status = STATUS_MAP.get(str(status.get('status', '')).strip().lower())
+        if not new_status:
+            continue
+
+        remains = _as_int(status.get('remains'), row.remains)
+        start_count = _as_int(status.get('start_count'), row.start_count)
+        if new_status == 'Completed':
+            remains = 0
+
+        if new_status == 'In Progress':
+            if remains != row.remains or start_count != row.start_count:
+                progress.append({'order_id': row.id, 'user_id': row.user_id, 'new_remains': remains, 'new_start_count': start_count})
+        else:
+            terminal.append((row, new_status, remains, start_count))
+    return progress, terminal
+
+
+def refund_amount(row, new_status, remains):
+    if new_status == 'Cancelled':
+        return Decimal(row.charge)
+    if new_status == 'Partial' and row.quantity:
+        return round_amount(Decimal(row.charge) * remains / row.quantity)
+    return Decimal(0)
+
+
+def apply_changes(progress, terminal):
+    """Write a batch of status changes; returns the number of orders changed"""
+    now = datetime.utcnow()
+    updated = 0
+    events = {}
+
+    if progress:
+        # One executemany UPDATE for every order that only moved forward
+        stmt = (
+            update(Order.__table__)
+            .where(Order.__table__.c.id == db.bindparam('order_id'))
+            .where(Order.__table__.c.status == 'In Progress')
+            .values(remains=db.bindparam('new_remains'), start_count=db.bindparam('new_start_count'), updated_at=now)
+        )
+        db.session.execute(stmt, [
+            {'order_id': item['order_id'], 'new_remains': item['new_remains'], 'new_start_count': item['new_start_count']}
+            for item in progress
+        ])
+        updated += len(progress)
+        for item in progress:
+            events.setdefault(item['user_id'], []).append(
+                order_payload(item['order_id'], 'In Progress', item['new_remains'], item['new_start_count'])
+            )
+
+    refunds = {}
+    for row, new_status, remains, start_count in terminal:
+        amount = refund_amount(row, new_status, remains)
+        # Guard on the old status so a concurrent admin change is never refunded twice;
+        # the amount is recorded so a later admin refund only credits the rest
+        changed = Order.query.filter_by(id=row.id, status='In Progress').update({
+            'status': new_status,
+            'remains': remains,
+            'start_count': start_count,
+            'refunded_amount': amount,
+            'updated_at': now
+        }, synchronize_session=False)
+        if changed:
+            updated += 1
+            events.setdefault(row.user_id, []).append(order_payload(row.id, new_status, remains, start_count))
+            if amount > 0:
+                refunds[row.user_id] = refunds.get(row.user_id, Decimal(0)) + amount
+
+    for user_id, amount in refunds.items():
+        credit(user_id, amount)
+
+    publish_orders(events)
+    db.session.commit()
+    return updated
+
+
+class ProviderSyncEngine:
+    """Periodically refreshes In Progress orders from the provider in batched status calls"""
+
+    def __init__(self, app, provider, batch_size=MAX_STATUS_BATCH, concurrency=4,
+                 calls_per_second=5, interval=300):
+        self.app = app
+        self.provider = provider
+        self.batch_size = min(batch_size, MAX_STATUS_BATCH)
+        self.concurrency = concurrency
+        self.interval = interval
+        self.limiter = RateLimiter(calls_per_second)
+        self.metrics = SyncMetrics()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='provider-sync')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pages(self):
+        """Yield In Progress orders in id order, one provider batch at a time"""
+        last_id = 0
+        while True:
+            rows = db.session.query(
+                Order.id, Order.user_id, Order.provider_order_id, Order.quantity,
+                Order.charge, Order.remains, Order.start_count
+            ).filter(
+                Order.status == 'In Progress',
+                Order.provider_order_id.isnot(None),
+                Order.id > last_id
+            ).order_by(Order.id).limit(self.batch_size).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
+
+    def _fetch(self, rows):
+        self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            statuses = self.provider.get_statuses([row.provider_order_id for row in rows])
+        except ProviderError as e:
+            self.metrics.record_batch(time.monotonic() - started, len(rows), failed=True)
+            logger.warning('Provider status batch failed: %s', e)
+            return rows, {}
+        self.metrics.record_batch(time.monotonic() - started, len(rows))
+        return rows, statuses
+
+    def run_once(self):
+        """Sweep every In Progress order once; returns the number of orders changed"""
+        updated = 0
+        with self.app.app_context():
+            group = []
+            for rows in self._pages():
+                group.append(rows)
+                if len(group) == self.concurrency:
+                    updated += self._apply_group(group)
+                    group = []
+            if group:
+                updated += self._apply_group(group)
+        self.metrics.record_updates(updated)
+        self.metrics.record_sweep()
+        return updated
+
+    def _apply_group(self, group):
+        # Provider calls run in parallel; writes stay on this thread's session
+        updated = 0
+        for rows, statuses in self._executor.map(self._fetch, group):
+            progress, terminal = plan_changes(rows, statuses)
+            if progress or terminal:
+                updated += apply_changes(progress, terminal)
+        return updated
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Provider status sync failed')
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='provider-sync', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=True)
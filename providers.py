@@ -0,0 +1,142 @@
+import itertools
+import threading
+from abc import ABC, abstractmethod
+
+# Providers accept at most this many order ids per status call
+MAX_STATUS_BATCH = 100
+
+
+class ProviderError(Exception):
+    """Raised when an upstream provider rejects or fails a request"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ProviderClient(ABC):
+    """Interface for upstream SMM providers; a client missing a method cannot be instantiated"""
+
+    @abstractmethod
+    def add_order(self, service_id, link, quantity):
+        """Submit an order and return the provider's order id"""
+
+    @abstractmethod
+    def get_statuses(self, provider_order_ids):
+        """Return {provider_order_id: {'status', 'start_count', 'remains'} or {'error'}}"""
+
+
+class HttpProviderClient(ProviderClient):
+    """Client for the standard SMM panel API (form POST with key and action)"""
+
+    def __init__(self, api_url, api_key, timeout=15, pool_size=10):
+        # requests is only needed when a real provider is configured
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _call(self, action, **params):
+        import requests
+
+        params.update({'key': self.api_key, 'action': action})
+        try:
+            response = self.session.post(self.api_url, data=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ProviderError(f'Provider request failed: {e}')
+
+        if response.status_code >= 500:
+            raise ProviderError(f'Provider returned HTTP {response.status_code}')
+
+        try:
+            data = response.json()
+        except ValueError:
+            raise ProviderError('Provider returned an invalid response')
+
+        if isinstance(data, dict) and data.get('error'):
+            raise ProviderError(str(data['error']), retryable=False)
+        return data
+
+    def add_order(self, service_id, link, quantity):
+        data = self._call('add', service=service_id, link=link, quantity=quantity)
+        if not data.get('order'):
+            raise ProviderError('Provider did not return an order id')
+        return str(data['order'])
+
+    def get_statuses(self, provider_order_ids):
+        if len(provider_order_ids) > MAX_STATUS_BATCH:
+            raise ValueError(f'At most {MAX_STATUS_BATCH} orders per status call')
+
+        data = self._call('status', orders=','.join(str(order_id) for order_id in provider_order_ids))
+        statuses = {}
+        for provider_order_id in provider_order_ids:
+            status = data.get(str(provider_order_id)) if isinstance(data, dict) else None
+            if not isinstance(status, dict):
+                status = {'error': 'Missing from provider response'}
+            statuses[str(provider_order_id)] = status
+        return statuses
+
+
+class FakeProviderClient(ProviderClient):
+    """In-memory provider for local development and tests
+
+    fail_next makes the next N calls raise a retryable ProviderError.
+    """
+
+    def __init__(self, fail_next=0):
+        self.fail_next = fail_next
+        self.orders = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_order(self, service_id, link, quantity):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise ProviderError('Fake provider failure')
+
+            provider_order_id = str(next(self._ids))
+            self.orders[provider_order_id] = {
+                'service_id': service_id,
+                'link': link,
+                'quantity': quantity,
+                'status': 'In progress',
+                'start_count': 0,
+                'remains': quantity
+            }
+            return provider_order_id
+
+    def get_statuses(self, provider_order_ids):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise ProviderError('Fake provider failure')
+
+            statuses = {}
+            for provider_order_id in provider_order_ids:
+                order = self.orders.get(str(provider_order_id))
+                if order is None:
+                    statuses[str(provider_order_id)] = {'error': 'Incorrect order ID'}
+                else:
+                    statuses[str(provider_order_id)] = {
+                        'status': order['status'],
+                        'start_count': order['start_count'],
+                        'remains': order['remains']
+                    }
+            return statuses
+
+    def set_status(self, provider_order_id, status, remains=None, start_count=None):
+        """Simulate provider-side progress on an order"""
+        with self._lock:
+            order = self.orders[str(provider_order_id)]
+            order['status'] = status
+            if remains is not None:
+                order['remains'] = remains
+            if start_count is not None:
+                order['start_count'] = start_count
@@ -0,0 +1,178 @@
+import codecs
+import csv
+import io
+import re
+from decimal import Decimal, InvalidOperation
+from models.user import db, Payment
+from models.balance import to_minor, from_minor
+from models.payment_review import review_payments, MAX_REVIEW_BATCH
+
+# Accepted header names (lower-cased) for the two columns we need
+TRANSACTION_HEADERS = ('transaction_id', 'transaction id', 'transaction', 'reference', 'ref', 'txn', 'txn id', 'رقم العملية')
+AMOUNT_HEADERS = ('amount', 'value', 'credit', 'المبلغ', 'القيمة')
+AUTO_APPROVE_NOTE = 'Auto-approved by statement reconciliation'
+# Excel on Arabic Windows saves "CSV" as cp1256 rather than UTF-8
+STATEMENT_ENCODINGS = ('utf-8-sig', 'cp1256')
+DETECT_CHUNK_SIZE = 64 * 1024
+# Upper bound on review items echoed back to the admin panel
+MAX_REVIEW_ITEMS = 1000
+
+_AMOUNT_CHARS = re.compile(r'[^0-9.\-]')
+
+
+class StatementError(ValueError):
+    """Raised when a statement file cannot be read"""
+
+
+def normalize_transaction_id(value):
+    return re.sub(r'\s+', '', str(value)).upper() if value is not None else ''
+
+
+def parse_amount(value):
+    """Parse '1,250.00 EGP' style amounts into piastres; None if unreadable"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return to_minor(value)
+    try:
+        return to_minor(Decimal(_AMOUNT_CHARS.sub('', str(value))))
+    except InvalidOperation:
+        return None
+
+
+def _column(header, names):
+    for index, name in enumerate(header):
+        if str(name or '').strip().lower() in names:
+            return index
+    raise StatementError(f'Statement has no {names[0]} column')
+
+
+def _rows_from_table(rows):
+    """Yield (transaction_id, amount_minor) from header + data rows; bad lines yield None"""
+    header = next(rows, None)
+    if header is None:
+        raise StatementError('Statement is empty')
+    transaction_column = _column(header, TRANSACTION_HEADERS)
+    amount_column = _column(header, AMOUNT_HEADERS)
+
+    for row in rows:
+        if not row or all(cell in (None, '') for cell in row):
+            continue
+        if len(row) <= max(transaction_column, amount_column):
+            yield None
+            continue
+        transaction_id = normalize_transaction_id(row[transaction_column])
+        amount = parse_amount(row[amount_column])
+        yield (transaction_id, amount) if transaction_id and amount is not None else None
+
+
+def read_statement(stream, filename):
+    """Stream statement lines from a CSV or XLSX export without loading it whole"""
+    if filename.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise StatementError('XLSX statements require openpyxl; upload a CSV export instead')
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            yield from _rows_from_table(workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(stream, encoding=_detect_encoding(stream), newline='')
+        try:
+            yield from _rows_from_table(csv.reader(text))
+        except UnicodeDecodeError:
+            raise StatementError('Statement is not UTF-8 or Windows-1256 text; export it as CSV UTF-8')
+        except csv.Error as e:
+            raise StatementError(f'Statement is not a valid CSV file: {e}')
+        finally:
+            # Leave the upload's stream open for the request to clean up
+            text.detach()
+
+
+def _detect_encoding(stream):
+    """First of STATEMENT_ENCODINGS that decodes the whole file, read in chunks"""
+    if not stream.seekable():
+        return STATEMENT_ENCODINGS[0]
+    start = stream.tell()
+    for encoding in STATEMENT_ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        stream.seek(start)
+        try:
+            for chunk in iter(lambda: stream.read(DETECT_CHUNK_SIZE), b''):
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            continue
+        stream.seek(start)
+        return encoding
+    raise StatementError('Statement is not UTF-8 or Windows-1256 text; export it as CSV UTF-8')
+
+
+def build_index(lines):
+    """Hash index of the statement: (transaction_id, amount) -> count, plus amounts per transaction_id"""
+    exact = {}
+    by_transaction = {}
+    stats = {'lines': 0, 'invalid_lines': 0}
+    for line in lines:
+        stats['lines'] += 1
+        if line is None:
+            stats['invalid_lines'] += 1
+            continue
+        exact[line] = exact.get(line, 0) + 1
+        by_transaction.setdefault(line[0], set()).add(line[1])
+    return exact, by_transaction, stats
+
+
+def reconcile(stream, filename, payment_method, dry_run=False):
+    """Match a statement against pending payments; exact matches are approved, near-misses listed
+
+    A statement comes from one wallet or bank account, and transaction ids are
+    only unique per payment method, so only that method's payments are matched.
+    """
+    exact, by_transaction, stats = build_index(read_statement(stream, filename))
+
+    query = db.session.query(Payment.id, Payment.user_id, Payment.transaction_id, Payment.amount, Payment.payment_method).filter(
+        Payment.status == 'Pending',
+        Payment.payment_method == payment_method,
+        Payment.transaction_id.isnot(None)
+    )
+
+    matched = []
+    review = []
+    for payment in query.order_by(Payment.id):
+        transaction_id = normalize_transaction_id(payment.transaction_id)
+        key = (transaction_id, to_minor(payment.amount))
+        if exact.get(key):
+            # Each statement line settles at most one payment
+            exact[key] -= 1
+            matched.append(payment.id)
+        elif transaction_id in by_transaction:
+            review.append({
+                'payment_id': payment.id,
+                'user_id': payment.user_id,
+                'transaction_id': payment.transaction_id,
+                'payment_method': payment.payment_method,
+                'amount': float(payment.amount),
+                'statement_amounts': sorted(float(from_minor(amount)) for amount in by_transaction[transaction_id]),
+                'reason': 'Amount does not match the statement'
+            })
+
+    approved = []
+    if not dry_run:
+        for start in range(0, len(matched), MAX_REVIEW_BATCH):
+            results = review_payments(matched[start:start + MAX_REVIEW_BATCH], 'approve', AUTO_APPROVE_NOTE)
+            approved.extend(result['payment_id'] for result in results if 'error' not in result)
+        db.session.commit()
+
+    return {
+        'statement_lines': stats['lines'],
+        'invalid_lines': stats['invalid_lines'],
+        'matched_count': len(matched),
+        'approved_count': len(approved),
+        'matched_payment_ids': matched if dry_run else approved,
+        'review_count': len(review),
+        'review': review[:MAX_REVIEW_ITEMS],
+        'dry_run': dry_run
+    }
@@ -0,0 +1,115 @@
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+
+# تشكيل، تطويل وعلامات قرآنية
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9'
+})
+ARABIC_ARTICLES = ('وال', 'بال', 'فال', 'كال', 'ال')
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_PREFIX_EXPANSIONS = 64
+
+
+def normalize_text(text):
+    """Fold case, Latin accents and Arabic hamza/alef/taa marbuta variants and diacritics"""
+    if not text:
+        return ''
+    text = ARABIC_DIACRITICS.sub('', text)
+    text = text.translate(ARABIC_LETTERS).casefold()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def strip_article(token):
+    for article in ARABIC_ARTICLES:
+        if token.startswith(article) and len(token) - len(article) >= 2:
+            return token[len(article):]
+    return token
+
+
+def tokenize(text):
+    """Split normalized text into tokens, also yielding Arabic tokens without the definite article"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(normalize_text(text)):
+        tokens.append(token)
+        stem = strip_article(token)
+        if stem != token:
+            tokens.append(stem)
+    return tokens
+
+
+class ServiceSearchIndex:
+    """In-memory inverted index over service names and descriptions"""
+
+    def __init__(self, services):
+        self.postings = {}
+        self.count = len(services)
+
+        for service in services:
+            self._add(service['id'], service.get('name'), NAME_WEIGHT)
+            self._add(service['id'], service.get('description'), DESCRIPTION_WEIGHT)
+
+        self.terms = sorted(self.postings)
+        self.idf = {
+            term: math.log(1 + self.count / float(len(postings)))
+            for term, postings in self.postings.items()
+        }
+
+    def _add(self, service_id, text, weight):
+        for token in tokenize(text):
+            postings = self.postings.setdefault(token, {})
+            postings[service_id] = postings.get(service_id, 0.0) + weight
+
+    def _expand(self, token):
+        """Yield indexed terms that start with the token, the exact term first"""
+        start = bisect_left(self.terms, token)
+        for term in self.terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            yield term
+
+    def search(self, query):
+        """Return service ids matching every query term, best match first"""
+        query_tokens = []
+        for token in TOKEN_PATTERN.findall(normalize_text(query)):
+            token = strip_article(token)
+            if token not in query_tokens:
+                query_tokens.append(token)
+        if not query_tokens:
+            return []
+
+        scores = None
+        for token in query_tokens:
+            token_scores = {}
+            for term in self._expand(token):
+                # Exact term matches rank above prefix matches
+                boost = 1.0 if term == token else 0.5
+                idf = self.idf[term]
+                for service_id, weight in self.postings[term].items():
+                    score = idf * weight * boost
+                    if score > token_scores.get(service_id, 0.0):
+                        token_scores[service_id] = score
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    service_id: score + token_scores[service_id]
+                    for service_id, score in scores.items()
+                    if service_id in token_scores
+                }
+            if not scores:
+                return []
+
+        return sorted(scores, key=lambda service_id: (-scores[service_id], service_id))
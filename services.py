@@ -1,9 +1,12 @@
 from flask import Blueprint, request, jsonify, session
 from models.user import db, Service
-from sqlalchemy import or_
+from models.catalog_cache import catalog_cache
+from models.popularity import popularity_ranking
 
 services_bp = Blueprint('services', __name__, url_prefix='/api/services')
 
+MAX_QUOTE_LINES = 500
+
 @services_bp.route('/', methods=['GET'])
 def get_services():
     try:
@@ -14,34 +17,13 @@ def get_services():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
         
-        # Build query
-        query = Service.query.filter_by(is_active=True)
-        
-        if platform:
-            query = query.filter(Service.platform == platform)
-        
-        if category:
-            query = query.filter(Service.service_type == category)
-        
-        if search:
-            query = query.filter(
-                or_(
-                    Service.name.contains(search),
-                    Service.description.contains(search)
-                )
-            )
-        
-        # Paginate results
-        services = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        # Catalog views and ranked search are both served from the catalog cache
+        services = catalog_cache.paginate(platform, category, page, per_page, search=search)
         
         return jsonify({
-            'services': [service.to_dict() for service in services.items],
-            'total': services.total,
-            'pages': services.pages,
+            'services': services['items'],
+            'total': services['total'],
+            'pages': services['pages'],
             'current_page': page,
             'per_page': per_page
         }), 200
@@ -67,10 +49,7 @@ def get_service(service_id):
 @services_bp.route('/platforms', methods=['GET'])
 def get_platforms():
     try:
-        platforms = db.session.query(Service.platform).filter_by(is_active=True).distinct().all()
-        platform_list = [platform[0] for platform in platforms]
-        
-        return jsonify({'platforms': platform_list}), 200
+        return jsonify({'platforms': catalog_cache.platforms()}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -80,15 +59,7 @@ def get_categories():
     try:
         platform = request.args.get('platform')
         
-        query = db.session.query(Service.service_type).filter_by(is_active=True)
-        
-        if platform:
-            query = query.filter(Service.platform == platform)
-        
-        categories = query.distinct().all()
-        category_list = [category[0] for category in categories]
-        
-        return jsonify({'categories': category_list}), 200
+        return jsonify({'categories': catalog_cache.categories(platform)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -96,12 +67,9 @@ def get_categories():
 @services_bp.route('/popular', methods=['GET'])
 def get_popular_services():
     try:
-        # Get most ordered services (you can implement this based on order count)
-        # For now, just return first 6 active services
-        services = Service.query.filter_by(is_active=True).limit(6).all()
-        
+        # Most ordered services over a rolling window, from incrementally maintained counters
         return jsonify({
-            'services': [service.to_dict() for service in services]
+            'services': popularity_ranking.top()
         }), 200
         
     except Exception as e:
@@ -122,18 +90,13 @@ def calculate_price():
         if not service:
             return jsonify({'error': 'Service not found'}), 404
         
-        if not service.is_active:
-            return jsonify({'error': 'Service is not available'}), 400
-        
-        # Validate quantity
-        if quantity < service.min_quantity:
-            return jsonify({'error': f'Minimum quantity is {service.min_quantity}'}), 400
-        
-        if quantity > service.max_quantity:
-            return jsonify({'error': f'Maximum quantity is {service.max_quantity}'}), 400
+        # Validate availability and quantity
+        error = service.validate_quantity(quantity)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Calculate price
-        price = (quantity / 1000) * float(service.price_per_1000)
+        price = service.calculate_price(quantity)
         
         return jsonify({
             'service_id': service_id,
@@ -145,3 +108,67 @@ def calculate_price():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@services_bp.route('/calculate-price/batch', methods=['POST'])
+def calculate_price_batch():
+    try:
+        data = request.get_json() or {}
+        items = data.get('items')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        
+        if len(items) > MAX_QUOTE_LINES:
+            return jsonify({'error': f'A quote can contain at most {MAX_QUOTE_LINES} lines'}), 400
+        
+        # Parse every line before touching the database
+        lines = []
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            line = {'index': index, 'service_id': item.get('service_id'), 'quantity': item.get('quantity')}
+            try:
+                line['service_id'] = int(line['service_id'])
+                line['quantity'] = int(line['quantity'])
+            except (TypeError, ValueError):
+                line['error'] = 'Service ID and quantity are required'
+            lines.append(line)
+        
+        # Load every referenced service in one query
+        service_ids = set(line['service_id'] for line in lines if 'error' not in line)
+        services = {}
+        if service_ids:
+            services = {
+                service.id: service
+                for service in Service.query.filter(Service.id.in_(service_ids)).all()
+            }
+        
+        total_price = 0.0
+        for line in lines:
+            if 'error' in line:
+                continue
+            
+            service = services.get(line['service_id'])
+            if not service:
+                line['error'] = 'Service not found'
+                continue
+            
+            error = service.validate_quantity(line['quantity'])
+            if error:
+                line['error'] = error
+                continue
+            
+            price = round(service.calculate_price(line['quantity']), 2)
+            line['price_per_1000'] = float(service.price_per_1000)
+            line['total_price'] = price
+            total_price += price
+        
+        error_count = sum(1 for line in lines if 'error' in line)
+        
+        return jsonify({
+            'items': lines,
+            'total_price': round(total_price, 2),
+            'valid_count': len(lines) - error_count,
+            'error_count': error_count
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from models.user import db, SiteSetting
+
+# Bumped on every settings write; other workers compare it to drop their copy
+VERSION_KEY = 'settings_version'
+# Seconds between version checks; reads in between never touch the database
+CHECK_INTERVAL = 15
+
+PAYMENT_METHODS_KEY = 'payment_methods'
+DEFAULT_PAYMENT_METHODS = [
+    {
+        'id': 'vodafone_cash',
+        'name': 'Vodafone Cash',
+        'icon': 'smartphone',
+        'instructions': 'قم بالتحويل إلى رقم: 01012345678 ثم أرسل رقم العملية',
+        'requires_phone': True
+    },
+    {
+        'id': 'orange_money',
+        'name': 'Orange Money',
+        'icon': 'smartphone',
+        'instructions': 'قم بالتحويل إلى رقم: 01112345678 ثم أرسل رقم العملية',
+        'requires_phone': True
+    },
+    {
+        'id': 'etisalat_cash',
+        'name': 'Etisalat Cash',
+        'icon': 'smartphone',
+        'instructions': 'قم بالتحويل إلى رقم: 01512345678 ثم أرسل رقم العملية',
+        'requires_phone': True
+    },
+    {
+        'id': 'bank_transfer',
+        'name': 'Bank Transfer',
+        'icon': 'building-bank',
+        'instructions': 'قم بالتحويل إلى حساب: 1234567890 - البنك الأهلي المصري',
+        'requires_phone': False
+    },
+    {
+        'id': 'instapay',
+        'name': 'InstaPay',
+        'icon': 'credit-card',
+        'instructions': 'قم بالتحويل عبر InstaPay إلى: sniper.server@instapay.com',
+        'requires_phone': False
+    }
+]
+
+
+class SettingsCache:
+    """Process-wide copy of site_settings, reloaded when the shared version changes"""
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # (settings dict, memoized derived values) swapped together on reload
+        self._state = None
+        self._version = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def _stored_version(self):
+        value = db.session.query(SiteSetting.setting_value).filter_by(setting_key=VERSION_KEY).scalar()
+        return int(value or 0)
+
+    def _refresh(self):
+        with self._lock:
+            if self._state is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._state
+            version = self._stored_version()
+            if self._state is None or version != self._version:
+                self._state = (dict(db.session.query(SiteSetting.setting_key, SiteSetting.setting_value)), {})
+                self._version = version
+                self.reloads += 1
+            self._checked_at = time.monotonic()
+            return self._state
+
+    def _current(self):
+        state = self._state
+        if state is None or time.monotonic() - self._checked_at >= self.check_interval:
+            state = self._refresh()
+        return state
+
+    def values(self):
+        return self._current()[0]
+
+    def get(self, key, default=None):
+        return self.values().get(key, default)
+
+    def derived(self, name, build):
+        """Memoize a value computed from the settings until the next reload"""
+        values, derived = self._current()
+        if name not in derived:
+            derived[name] = build(values)
+        return derived[name]
+
+    def invalidate(self):
+        """Force the next read to check the stored version"""
+        with self._lock:
+            self._checked_at = 0.0
+
+    def stats(self):
+        return {
+            'version': self._version,
+            'keys': len(self._state[0]) if self._state else 0,
+            'reloads': self.reloads,
+            'check_interval': self.check_interval
+        }
+
+
+settings_cache = SettingsCache()
+
+
+def set_setting(key, value, description=None):
+    """Store a setting and bump the shared version so every worker reloads"""
+    setting = SiteSetting.query.filter_by(setting_key=key).first()
+    if setting is None:
+        setting = SiteSetting(setting_key=key)
+        db.session.add(setting)
+    setting.setting_value = value
+    if description is not None:
+        setting.description = description
+
+    bumped = SiteSetting.query.filter_by(setting_key=VERSION_KEY).update(
+        {'setting_value': db.cast(db.cast(SiteSetting.setting_value, db.Integer) + 1, db.String)},
+        synchronize_session=False
+    )
+    if not bumped:
+        db.session.add(SiteSetting(setting_key=VERSION_KEY, setting_value='1', description='إصدار الإعدادات'))
+    db.session.commit()
+    settings_cache.invalidate()
+
+
+def _stored_payment_methods(values):
+    raw = values.get(PAYMENT_METHODS_KEY)
+    return json.loads(raw) if raw else DEFAULT_PAYMENT_METHODS
+
+
+def _enabled_payment_methods(values):
+    return [method for method in _stored_payment_methods(values) if method.get('enabled', True)]
+
+
+def all_payment_methods():
+    """Every configured payment method, including disabled ones"""
+    return settings_cache.derived('all_payment_methods', _stored_payment_methods)
+
+
+def payment_methods():
+    """Enabled payment methods, as shown on the deposit page"""
+    return settings_cache.derived('payment_methods', _enabled_payment_methods)
+
+
+def payment_method(name):
+    """The enabled payment method with this display name, or None"""
+    by_name = settings_cache.derived(
+        'payment_methods_by_name',
+        lambda values: dict((method['name'], method) for method in _enabled_payment_methods(values))
+    )
+    return by_name.get(name)
+
+
+def validate_payment_methods(methods):
+    """Return an error message for a malformed method list, otherwise None"""
+    if not isinstance(methods, list) or not methods:
+        return 'methods must be a non-empty list'
+    seen = set()
+    for method in methods:
+        if not isinstance(method, dict):
+            return 'each method must be an object'
+        for field in ('id', 'name', 'instructions'):
+            if not isinstance(method.get(field), str) or not method[field].strip():
+                return f'{field} is required for every method'
+        if not isinstance(method.get('requires_phone', False), bool) or not isinstance(method.get('enabled', True), bool):
+            return 'requires_phone and enabled must be true or false'
+        if method['id'] in seen or method['name'] in seen:
+            return f"Duplicate payment method {method['name']}"
+        seen.update((method['id'], method['name']))
+    return None
+
+
+def set_payment_methods(methods):
+    set_setting(
+        PAYMENT_METHODS_KEY,
+        json.dumps(methods, ensure_ascii=False),
+        description='وسائل الدفع المتاحة وتعليمات التحويل'
+    )
@@ -0,0 +1,102 @@
+from sqlalchemy import func, literal, select, union_all
+from models.user import db, Order, OrderArchive, Payment, Ticket
+from models.balance import get_balance
+
+# (model, amount column) sources per stats domain; tickets carry no amount.
+# Archived orders still count towards a user's history.
+STATS_DOMAINS = {
+    'orders': [(Order, Order.charge), (OrderArchive, OrderArchive.charge)],
+    'payments': [(Payment, Payment.amount)],
+    'tickets': [(Ticket, None)]
+}
+
+
+def _grouped_select(domain, model, amount, user_id):
+    return select(
+        literal(domain).label('domain'),
+        model.status.label('status'),
+        func.count(model.id).label('count'),
+        func.coalesce(func.sum(amount), 0).label('amount') if amount is not None else literal(0).label('amount')
+    ).where(model.user_id == user_id).group_by(model.status)
+
+
+def status_breakdowns(user_id, domains):
+    """Count and sum rows per status for each domain in a single GROUP BY pass"""
+    selects = [
+        _grouped_select(domain, model, amount, user_id)
+        for domain in domains
+        for model, amount in STATS_DOMAINS[domain]
+    ]
+    stmt = selects[0] if len(selects) == 1 else union_all(*selects)
+
+    breakdowns = dict((domain, {}) for domain in domains)
+    for domain, status, count, amount in db.session.execute(stmt):
+        row = breakdowns[domain].setdefault(status, {'count': 0, 'amount': 0.0})
+        row['count'] += count
+        row['amount'] += float(amount or 0)
+    return breakdowns
+
+
+def _count(breakdown, status=None):
+    if status is None:
+        return sum(row['count'] for row in breakdown.values())
+    return breakdown.get(status, {}).get('count', 0)
+
+
+def _amount(breakdown, status=None):
+    if status is None:
+        return sum(row['amount'] for row in breakdown.values())
+    return breakdown.get(status, {}).get('amount', 0.0)
+
+
+def format_order_stats(breakdown):
+    return {
+        'total_orders': _count(breakdown),
+        'pending_orders': _count(breakdown, 'Pending'),
+        'in_progress_orders': _count(breakdown, 'In Progress'),
+        'completed_orders': _count(breakdown, 'Completed'),
+        'total_spent': round(_amount(breakdown), 2)
+    }
+
+
+def format_payment_stats(breakdown, current_balance):
+    return {
+        'total_deposits': round(_amount(breakdown, 'Approved'), 2),
+        'pending_deposits': round(_amount(breakdown, 'Pending'), 2),
+        'current_balance': float(current_balance) if current_balance is not None else 0,
+        'total_payments': _count(breakdown),
+        'approved_payments': _count(breakdown, 'Approved')
+    }
+
+
+def format_ticket_stats(breakdown):
+    return {
+        'total_tickets': _count(breakdown),
+        'open_tickets': _count(breakdown, 'Open'),
+        'answered_tickets': _count(breakdown, 'Answered'),
+        'awaiting_tickets': _count(breakdown, 'Awaiting Reply'),
+        'closed_tickets': _count(breakdown, 'Closed')
+    }
+
+
+def order_stats(user_id):
+    return format_order_stats(status_breakdowns(user_id, ['orders'])['orders'])
+
+
+def payment_stats(user_id):
+    breakdown = status_breakdowns(user_id, ['payments'])['payments']
+    return format_payment_stats(breakdown, get_balance(user_id))
+
+
+def ticket_stats(user_id):
+    return format_ticket_stats(status_breakdowns(user_id, ['tickets'])['tickets'])
+
+
+def dashboard_stats(user_id):
+    """Order, payment and ticket stats for the dashboard in two queries"""
+    breakdowns = status_breakdowns(user_id, ['orders', 'payments', 'tickets'])
+    return {
+        'orders': format_order_stats(breakdowns['orders']),
+        'payments': format_payment_stats(breakdowns['payments'], get_balance(user_id)),
+        'tickets': format_ticket_stats(breakdowns['tickets'])
+    }
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import pytest
+from flask import Flask
+
+# Route and model modules import each other as models.* / routes.*, as they do under src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from models.user import db, User, Service
+from routes.admin import admin_bp
+from routes.auth import auth_bp
+from routes.orders import orders_bp
+from routes.payments import payments_bp
+
+PASSWORD = 'Passw0rd'
+
+
+@pytest.fixture
+def app():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SECRET_KEY='test',
+        # A file database so threads in the contention tests share it
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+        UPLOAD_FOLDER=tempfile.mkdtemp()
+    )
+    for blueprint in (auth_bp, orders_bp, payments_bp, admin_bp):
+        app.register_blueprint(blueprint)
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Service(
+            name='متابعين إنستغرام', platform='Instagram', service_type='followers',
+            price_per_1000=10, min_quantity=100, max_quantity=10000
+        ))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    os.remove(path)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def create_user(username, balance_minor=0, is_admin=False):
+    user = User(username=username, email=f'{username}@example.com', balance_minor=balance_minor, is_admin=is_admin)
+    user.set_password(PASSWORD)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def login(client, username):
+    response = client.post('/api/auth/login', json={'username': username, 'password': PASSWORD})
+    assert response.status_code == 200, response.get_json()
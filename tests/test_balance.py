@@ -0,0 +1,70 @@
+import threading
+from decimal import Decimal
+from models.user import db
+from models.balance import debit, credit, get_balance, to_minor, round_amount
+from conftest import create_user
+
+
+def test_to_minor_rounds_half_up():
+    assert to_minor('12.345') == 1235
+    assert to_minor(0.1 + 0.2) == 30
+    assert round_amount('9.995') == Decimal('10.00')
+
+
+def test_debit_never_overdraws(app):
+    user_id = create_user('alice', balance_minor=to_minor(5)).id
+
+    assert debit(user_id, 10) is False
+    db.session.rollback()
+    assert get_balance(user_id) == Decimal('5.00')
+
+    assert debit(user_id, 5) is True
+    db.session.commit()
+    assert get_balance(user_id) == Decimal('0.00')
+
+
+def test_credit_unknown_user(app):
+    assert credit(12345, 10) is False
+
+
+def _hammer(app, user_id, operation, amount, attempts, results):
+    with app.app_context():
+        for _ in range(attempts):
+            ok = operation(user_id, amount)
+            db.session.commit()
+            results.append(ok)
+        db.session.remove()
+
+
+def _run_threads(app, user_id, operation, amount, threads, attempts):
+    results = []
+    workers = [
+        threading.Thread(target=_hammer, args=(app, user_id, operation, amount, attempts, results))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def test_concurrent_debits_spend_each_piastre_once(app):
+    user_id = create_user('bob', balance_minor=to_minor(100)).id
+
+    # 40 debits of 3.00 race for 100.00: exactly 33 may succeed
+    results = _run_threads(app, user_id, debit, 3, threads=8, attempts=5)
+
+    db.session.expire_all()
+    assert results.count(True) == 33
+    assert get_balance(user_id) == Decimal('1.00')
+
+
+def test_concurrent_credits_are_not_lost(app):
+    user_id = create_user('carol').id
+
+    results = _run_threads(app, user_id, credit, '0.01', threads=8, attempts=25)
+
+    db.session.expire_all()
+    assert all(results)
+    assert get_balance(user_id) == Decimal('2.00')
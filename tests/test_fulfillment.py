@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from models.user import db, Order
+from models.providers import FakeProviderClient, ProviderError
+from models.fulfillment import (
+    MAX_ATTEMPTS, FulfillmentWorker, claim_order, due_order_ids, retry_delay, submit_order
+)
+from conftest import create_user
+
+
+def _pending_order():
+    user = create_user('alice')
+    order = Order(user_id=user.id, service_id=1, link='https://instagram.com/someone', quantity=1000, charge=10, status='Pending')
+    db.session.add(order)
+    db.session.commit()
+    return order.id
+
+
+def _attempt(provider, order_id):
+    assert claim_order(order_id)
+    return submit_order(provider, order_id)
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+    assert retry_delay(1) == timedelta(seconds=30)
+    assert retry_delay(2) == timedelta(seconds=60)
+    assert retry_delay(3) == timedelta(seconds=120)
+    assert retry_delay(20) == timedelta(hours=1)
+
+
+def test_failed_submission_backs_off_then_succeeds(app):
+    order_id = _pending_order()
+    provider = FakeProviderClient(fail_next=1)
+
+    before = datetime.utcnow()
+    assert not _attempt(provider, order_id)
+
+    order = db.session.get(Order, order_id)
+    db.session.refresh(order)
+    assert order.status == 'Pending'
+    assert order.fulfillment_attempts == 1
+    assert order.last_error == 'Fake provider failure'
+    assert before + retry_delay(1) <= order.next_attempt_at <= datetime.utcnow() + retry_delay(1)
+
+    # Not due again until the backoff has passed
+    assert due_order_ids(10) == []
+    assert due_order_ids(10, now=order.next_attempt_at) == [order_id]
+
+    assert _attempt(provider, order_id)
+    db.session.refresh(order)
+    assert order.status == 'In Progress'
+    assert order.provider_order_id == '1'
+    assert order.fulfillment_attempts == 2
+    assert order.next_attempt_at is None
+    assert order.last_error is None
+
+
+def test_orders_leave_the_queue_after_max_attempts(app):
+    order_id = _pending_order()
+    provider = FakeProviderClient(fail_next=MAX_ATTEMPTS)
+
+    for attempt in range(MAX_ATTEMPTS):
+        order = db.session.get(Order, order_id)
+        db.session.refresh(order)
+        now = order.next_attempt_at or datetime.utcnow()
+        assert due_order_ids(10, now=now) == [order_id]
+        assert not _attempt(provider, order_id)
+
+    db.session.refresh(order)
+    assert order.status == 'Pending'
+    assert order.fulfillment_attempts == MAX_ATTEMPTS
+    assert order.next_attempt_at is None
+    assert due_order_ids(10, now=datetime.utcnow() + timedelta(days=1)) == []
+
+
+class RejectingProvider(FakeProviderClient):
+    def add_order(self, service_id, link, quantity):
+        raise ProviderError('Invalid link', retryable=False)
+
+
+def test_permanent_errors_are_not_retried(app):
+    order_id = _pending_order()
+
+    assert not _attempt(RejectingProvider(), order_id)
+
+    order = db.session.get(Order, order_id)
+    db.session.refresh(order)
+    assert order.fulfillment_attempts == MAX_ATTEMPTS
+    assert order.last_error == 'Invalid link'
+    assert due_order_ids(10, now=datetime.utcnow() + timedelta(days=1)) == []
+
+
+def test_worker_submits_due_orders(app):
+    order_id = _pending_order()
+    provider = FakeProviderClient(fail_next=1)
+    worker = FulfillmentWorker(app, provider, workers=2)
+    try:
+        assert worker.run_once() == 0
+        # Still backing off, so the next poll leaves it alone
+        assert worker.run_once() == 0
+        Order.query.filter_by(id=order_id).update({'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        assert worker.run_once() == 1
+    finally:
+        worker.stop()
+
+    order = db.session.get(Order, order_id)
+    db.session.refresh(order)
+    assert order.status == 'In Progress'
+    assert provider.orders[order.provider_order_id]['quantity'] == 1000
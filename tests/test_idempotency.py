@@ -0,0 +1,67 @@
+from models.user import db, Order, IdempotencyKey
+from models.balance import credit, get_balance, to_minor
+from conftest import create_user, login
+
+ORDER = {'service_id': 1, 'link': 'https://instagram.com/someone', 'quantity': 1000}
+
+
+def _place(client, key, body=ORDER):
+    return client.post('/api/orders/', json=body, headers={'Idempotency-Key': key})
+
+
+def test_replay_returns_stored_response_without_charging_twice(app, client):
+    user_id = create_user('alice', balance_minor=to_minor(100)).id
+    login(client, 'alice')
+
+    first = _place(client, 'order-1')
+    second = _place(client, 'order-1')
+
+    assert first.status_code == 201
+    assert second.status_code == 201
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+    assert Order.query.filter_by(user_id=user_id).count() == 1
+    assert get_balance(user_id) == 90
+
+
+def test_reused_key_with_different_body_is_rejected(app, client):
+    create_user('alice', balance_minor=to_minor(100))
+    login(client, 'alice')
+
+    assert _place(client, 'order-1').status_code == 201
+    response = _place(client, 'order-1', dict(ORDER, quantity=2000))
+
+    assert response.status_code == 422
+    assert Order.query.count() == 1
+
+
+def test_client_errors_are_replayed_too(app, client):
+    user_id = create_user('alice').id
+    login(client, 'alice')
+
+    first = _place(client, 'order-1')
+    assert first.status_code == 400
+
+    # Topping up does not turn the stored answer into a new order
+    credit(user_id, 100)
+    db.session.commit()
+    second = _place(client, 'order-1')
+
+    assert second.status_code == 400
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert Order.query.count() == 0
+
+
+def test_keys_are_scoped_per_user(app, client):
+    create_user('alice', balance_minor=to_minor(100))
+    create_user('bob', balance_minor=to_minor(100))
+    other = app.test_client()
+    login(client, 'alice')
+    login(other, 'bob')
+
+    assert _place(client, 'shared').status_code == 201
+    response = _place(other, 'shared', dict(ORDER, link='https://instagram.com/another'))
+
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    assert IdempotencyKey.query.count() == 2
@@ -0,0 +1,71 @@
+import pytest
+from models.user import db, Order
+from models.links import canonicalize_link, link_target_hash
+from models.order_targets import backfill_target_hashes
+from conftest import create_user, login
+
+
+@pytest.mark.parametrize('link, canonical', [
+    ('https://www.instagram.com/SomeOne/?igshid=abc&utm_source=x', 'instagram:/someone'),
+    ('http://m.instagram.com/someone', 'instagram:/someone'),
+    ('https://instagram.com/p/AbC123/', 'instagram:/p/AbC123'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=share&t=10', 'youtube:/watch?v=dQw4w9WgXcQ'),
+    ('https://tiktok.com/@Bob/video/1#comments', 'tiktok:/@bob/video/1'),
+    ('@Some.User.', '@some.user'),
+    ('  https://twitter.com/Jack  ', 'twitter:/jack'),
+])
+def test_equivalent_links_share_a_canonical_form(link, canonical):
+    assert canonicalize_link(link).canonical == canonical
+
+
+@pytest.mark.parametrize('link', [
+    'https://instagram.com.evil.com/a',
+    'https://instagram.com.evil.com/b',
+    'https://instagram.com:8080/x',
+    'https://instagram.comxyz/a',
+    'https://instagram.com',
+    'https://instagram.com/',
+    'https://instagram.com/?utm_source=x',
+    'https://notinstagram.com/a',
+    'ftp://instagram.com/a',
+    '@user name',
+    'someone',
+    '',
+])
+def test_rejects_lookalike_hosts_ports_and_bare_hosts(link):
+    assert canonicalize_link(link) is None
+    assert link_target_hash(link) is None
+
+
+def test_distinct_targets_hash_differently():
+    assert link_target_hash('https://instagram.com/a') != link_target_hash('https://instagram.com/b')
+    assert link_target_hash('https://instagram.com/a') != link_target_hash('https://facebook.com/a')
+    assert link_target_hash('https://instagram.com/a') == link_target_hash('https://www.instagram.com/A/')
+
+
+def test_duplicate_active_order_is_rejected_after_backfill(app, client):
+    user_id = create_user('alice', balance_minor=10000).id
+    # Placed before target_hash existed
+    db.session.add(Order(
+        user_id=user_id, service_id=1, link='https://instagram.com/someone', quantity=100,
+        charge=1, status='In Progress'
+    ))
+    db.session.add(Order(
+        user_id=user_id, service_id=1, link='https://instagram.com/finished', quantity=100,
+        charge=1, status='Completed'
+    ))
+    db.session.commit()
+
+    assert backfill_target_hashes() == 1
+    login(client, 'alice')
+
+    duplicate = client.post('/api/orders/', json={
+        'service_id': 1, 'link': 'https://www.instagram.com/SomeOne/?igshid=1', 'quantity': 100
+    })
+    assert duplicate.status_code == 400
+    assert duplicate.get_json()['error'] == 'An active order for this link already exists'
+
+    finished = client.post('/api/orders/', json={
+        'service_id': 1, 'link': 'https://instagram.com/finished', 'quantity': 100
+    })
+    assert finished.status_code == 201
@@ -0,0 +1,112 @@
+from sqlalchemy import text
+from models.user import db, Service, Order, Payment, Ticket, TicketMessage
+from models.migrations import upgrade_schema, table_columns
+from models.order_targets import backfill_target_hashes
+from models.ticket_counters import backfill_ticket_counters
+from conftest import create_user, login
+
+
+def _indexes(table):
+    return set(row[0] for row in db.session.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), {'table': table}
+    ))
+
+
+def _drop(model, columns):
+    table = model.__table__.name
+    for index in model.__table__.indexes:
+        if any(column.name in columns for column in index.columns):
+            db.session.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    for column in columns:
+        db.session.execute(text(f'ALTER TABLE "{table}" DROP COLUMN {column}'))
+    db.session.commit()
+
+
+def test_fresh_database_needs_no_migration(app):
+    assert upgrade_schema() == []
+
+
+def test_fulfillment_columns_are_added_to_old_tables(app):
+    _drop(Service, ['provider_service_id'])
+    _drop(Order, ['provider_order_id', 'fulfillment_attempts', 'next_attempt_at', 'claimed_at', 'last_error'])
+
+    assert 'migrate_fulfillment_columns' in upgrade_schema()
+
+    assert 'provider_service_id' in table_columns(Service)
+    assert {'provider_order_id', 'fulfillment_attempts', 'next_attempt_at', 'claimed_at', 'last_error'} <= set(table_columns(Order))
+    assert {'idx_order_fulfillment', 'ix_order_provider_order_id'} <= _indexes('order')
+    assert Service.query.count() == 1
+    assert upgrade_schema() == []
+
+
+def test_target_hash_is_added_before_the_backfill(app):
+    user_id = create_user('alice').id
+    db.session.add(Order(user_id=user_id, service_id=1, link='https://www.instagram.com/Someone/', quantity=1000, charge=10))
+    db.session.commit()
+    _drop(Order, ['target_hash'])
+
+    assert upgrade_schema() == ['migrate_order_targets']
+    assert 'idx_order_target' in _indexes('order')
+    assert backfill_target_hashes() == 1
+    assert Order.query.one().target_hash is not None
+
+
+def test_refunded_amount_is_backfilled(app):
+    user_id = create_user('alice').id
+    for status, remains, provider_order_id in (
+        ('Cancelled', 1000, None), ('Partial', 250, '7'), ('Partial', 250, None), ('Completed', 0, '8')
+    ):
+        db.session.add(Order(
+            user_id=user_id, service_id=1, link='https://instagram.com/someone', quantity=1000,
+            charge=10, remains=remains, status=status, provider_order_id=provider_order_id
+        ))
+    db.session.commit()
+    _drop(Order, ['refunded_amount'])
+
+    assert 'migrate_refund_columns' in upgrade_schema()
+
+    refunded = [float(order.refunded_amount) for order in Order.query.order_by(Order.id)]
+    assert refunded == [10.0, 2.5, 0.0, 0.0]
+
+
+def test_duplicate_transactions_hold_back_the_unique_index(app, client):
+    user_id = create_user('alice').id
+    db.session.execute(text('DROP INDEX uq_payment_transaction'))
+    for _ in range(2):
+        db.session.add(Payment(user_id=user_id, amount=50, payment_method='InstaPay', transaction_id='TX1', status='Pending'))
+    db.session.commit()
+
+    assert 'migrate_payment_transaction_index' not in upgrade_schema()
+    assert 'uq_payment_transaction' not in _indexes('payment')
+
+    # Without the index the route still rejects a third copy up front
+    login(client, 'alice')
+    response = client.post('/api/payments/', json={'amount': 50, 'payment_method': 'InstaPay', 'transaction_id': 'TX1'})
+    assert response.status_code == 400
+    assert Payment.query.count() == 2
+
+    Payment.query.filter_by(id=2).delete()
+    db.session.commit()
+
+    assert 'migrate_payment_transaction_index' in upgrade_schema()
+    assert 'uq_payment_transaction' in _indexes('payment')
+
+
+def test_ticket_counters_are_added_before_the_backfill(app):
+    user_id = create_user('alice').id
+    ticket = Ticket(user_id=user_id, subject='طلب متأخر')
+    db.session.add(ticket)
+    db.session.flush()
+    db.session.add(TicketMessage(ticket_id=ticket.id, user_id=user_id, message='لم يبدأ الطلب'))
+    db.session.commit()
+    _drop(Ticket, ['message_count', 'last_message_at', 'last_reply_by_admin'])
+
+    assert upgrade_schema() == ['migrate_ticket_counters']
+    assert {'idx_ticket_last_message', 'idx_ticket_status_last_message'} <= _indexes('ticket')
+    assert Ticket.query.filter(Ticket.last_message_at.is_(None)).count() == 1
+
+    backfill_ticket_counters()
+    ticket = Ticket.query.one()
+    assert ticket.message_count == 1
+    assert ticket.last_message_at is not None
+    assert ticket.last_reply_by_admin is False
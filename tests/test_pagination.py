@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+import pytest
+from models.user import db, Order
+from models.pagination import encode_cursor, decode_cursor, InvalidCursor
+from conftest import create_user, login
+
+BASE_TIME = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def _add_orders(user_id, created_times, first_id=None):
+    for index, created_at in enumerate(created_times):
+        order = Order(
+            user_id=user_id, service_id=1, link='https://instagram.com/someone', quantity=100,
+            charge=1, status='Pending', created_at=created_at
+        )
+        if first_id is not None:
+            order.id = first_id[index]
+        db.session.add(order)
+    db.session.commit()
+
+
+def _page(client, **args):
+    response = client.get('/api/orders/', query_string=dict(pagination='cursor', per_page=3, **args))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 5, 6, 7, 8, 9, 123456)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42, 'next')
+    assert decode_cursor(encode_cursor(created_at, 42, 'prev')) == (created_at, 42, 'prev')
+
+
+def test_cursor_rejects_null_and_garbage():
+    with pytest.raises(ValueError):
+        encode_cursor(None, 1)
+    for cursor in ('not-base64!', encode_cursor(BASE_TIME, 1)[:-3], 'W251bGwsIDEsICJuZXh0Il0'):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(cursor)
+
+
+def test_walks_every_row_once_across_timestamp_ties(app, client):
+    user_id = create_user('alice').id
+    # Several orders share a created_at, so the id must break ties
+    _add_orders(user_id, [BASE_TIME] * 4 + [BASE_TIME + timedelta(minutes=i) for i in range(1, 5)])
+    login(client, 'alice')
+    expected = [order.id for order in Order.query.order_by(Order.created_at.desc(), Order.id.desc())]
+
+    seen = []
+    pages = []
+    page = _page(client)
+    while True:
+        pages.append(page)
+        seen.extend(order['id'] for order in page['orders'])
+        if not page['next_cursor']:
+            break
+        page = _page(client, cursor=page['next_cursor'])
+
+    assert seen == expected
+    assert len(pages) == 3
+
+    # prev from the second page returns exactly the first page
+    back = _page(client, cursor=pages[1]['prev_cursor'])
+    assert [order['id'] for order in back['orders']] == [order['id'] for order in pages[0]['orders']]
+    assert back['prev_cursor'] is None
+
+
+def test_invalid_cursor_is_a_client_error(app, client):
+    create_user('alice')
+    login(client, 'alice')
+
+    response = client.get('/api/orders/', query_string={'cursor': 'garbage'})
+    assert response.status_code == 400
+
+
+def test_estimated_total_counts_rows_not_the_id_span(app, client):
+    user_id = create_user('alice').id
+    other_id = create_user('bob').id
+    _add_orders(user_id, [BASE_TIME, BASE_TIME], first_id=[5, 100000])
+    _add_orders(other_id, [BASE_TIME] * 3)
+    login(client, 'alice')
+
+    page = _page(client, total='estimate')
+    assert page['total'] == 2
+    assert page['total_is_estimate'] is False
+    assert _page(client, total='exact')['total'] == 2
@@ -0,0 +1,140 @@
+from decimal import Decimal
+import pytest
+from models.user import db, Order
+from models.balance import get_balance
+from models.providers import FakeProviderClient
+from models.provider_sync import ProviderSyncEngine, refund_amount
+from conftest import create_user, login
+
+
+@pytest.fixture
+def provider():
+    return FakeProviderClient()
+
+
+@pytest.fixture
+def engine(app, provider):
+    engine = ProviderSyncEngine(app, provider, batch_size=2, concurrency=2, calls_per_second=1000)
+    yield engine
+    engine.stop()
+
+
+def _submitted_order(provider, user_id, quantity=1000, charge=10):
+    order = Order(
+        user_id=user_id, service_id=1, link='https://instagram.com/someone', quantity=quantity,
+        charge=charge, status='In Progress', remains=quantity,
+        provider_order_id=provider.add_order(1, 'https://instagram.com/someone', quantity)
+    )
+    db.session.add(order)
+    db.session.commit()
+    return order
+
+
+def _reload(order):
+    # The engine writes through its own app context and session
+    db.session.expire_all()
+    return db.session.get(Order, order.id)
+
+
+def test_refund_amount():
+    order = Order(charge=Decimal('10.00'), quantity=1000)
+    assert refund_amount(order, 'Cancelled', 1000) == Decimal('10.00')
+    assert refund_amount(order, 'Partial', 333) == Decimal('3.33')
+    assert refund_amount(order, 'Partial', 0) == 0
+    assert refund_amount(order, 'Completed', 0) == 0
+
+
+def test_progress_is_written_without_a_refund(app, provider, engine):
+    user_id = create_user('alice').id
+    order = _submitted_order(provider, user_id)
+    provider.set_status(order.provider_order_id, 'In progress', remains=400, start_count=50)
+
+    assert engine.run_once() == 1
+    order = _reload(order)
+    assert (order.status, order.remains, order.start_count) == ('In Progress', 400, 50)
+    assert get_balance(user_id) == 0
+
+    # Nothing new from the provider, nothing written
+    assert engine.run_once() == 0
+
+
+def test_every_batch_is_swept(app, provider, engine):
+    user_id = create_user('alice').id
+    orders = [_submitted_order(provider, user_id) for _ in range(5)]
+    for order in orders:
+        provider.set_status(order.provider_order_id, 'Completed')
+
+    assert engine.run_once() == 5
+    assert all(_reload(order).status == 'Completed' for order in orders)
+    assert engine.metrics.to_dict()['batches'] == 3
+
+
+def test_partial_refunds_the_remains_share(app, provider, engine):
+    user_id = create_user('alice').id
+    order = _submitted_order(provider, user_id)
+    provider.set_status(order.provider_order_id, 'Partial', remains=250)
+
+    assert engine.run_once() == 1
+    order = _reload(order)
+    assert order.status == 'Partial'
+    assert order.refunded_amount == Decimal('2.50')
+    assert get_balance(user_id) == Decimal('2.50')
+
+    # A terminal order is not polled again, so the refund is not repeated
+    assert engine.run_once() == 0
+    assert get_balance(user_id) == Decimal('2.50')
+
+
+def test_cancel_refunds_the_whole_charge(app, provider, engine):
+    user_id = create_user('alice').id
+    order = _submitted_order(provider, user_id)
+    provider.set_status(order.provider_order_id, 'Canceled')
+
+    assert engine.run_once() == 1
+    order = _reload(order)
+    assert order.status == 'Cancelled'
+    assert order.refunded_amount == 10
+    assert get_balance(user_id) == 10
+
+
+def test_failed_batch_is_retried_on_the_next_sweep(app, provider, engine):
+    user_id = create_user('alice').id
+    order = _submitted_order(provider, user_id)
+    provider.set_status(order.provider_order_id, 'Completed')
+    provider.fail_next = 1
+
+    assert engine.run_once() == 0
+    assert engine.metrics.to_dict()['failed_batches'] == 1
+    assert _reload(order).status == 'In Progress'
+
+    assert engine.run_once() == 1
+    assert _reload(order).status == 'Completed'
+
+
+def test_admin_refund_after_partial_credits_only_the_rest(app, client, provider, engine):
+    user_id = create_user('alice').id
+    create_user('admin', is_admin=True)
+    order = _submitted_order(provider, user_id)
+    provider.set_status(order.provider_order_id, 'Partial', remains=250)
+    engine.run_once()
+    login(client, 'admin')
+
+    response = client.post(f'/api/admin/orders/{order.id}/update', json={'status': 'Refunded'})
+
+    assert response.status_code == 200
+    assert response.get_json()['order']['refunded_amount'] == 10
+    assert get_balance(user_id) == 10
+
+
+def test_admin_refund_after_provider_cancel_is_rejected(app, client, provider, engine):
+    user_id = create_user('alice').id
+    create_user('admin', is_admin=True)
+    order = _submitted_order(provider, user_id)
+    provider.set_status(order.provider_order_id, 'Canceled')
+    engine.run_once()
+    login(client, 'admin')
+
+    response = client.post(f'/api/admin/orders/{order.id}/update', json={'status': 'Refunded'})
+
+    assert response.status_code == 400
+    assert get_balance(user_id) == 10
@@ -0,0 +1,37 @@
+import io
+import pytest
+from models.user import db, Payment
+from models.reconciliation import StatementError, read_statement, reconcile
+from conftest import create_user
+
+ARABIC_STATEMENT = 'رقم العملية,المبلغ\nTX1,50\nTX2,75.50\n'
+
+
+def _payment(user_id, transaction_id, amount, payment_method='InstaPay'):
+    db.session.add(Payment(
+        user_id=user_id, amount=amount, payment_method=payment_method,
+        transaction_id=transaction_id, status='Pending'
+    ))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-8-sig', 'cp1256'])
+def test_arabic_headers_in_any_excel_encoding(encoding):
+    stream = io.BytesIO(ARABIC_STATEMENT.encode(encoding))
+    assert list(read_statement(stream, 'statement.csv')) == [('TX1', 5000), ('TX2', 7550)]
+
+
+def test_binary_upload_is_a_statement_error():
+    with pytest.raises(StatementError):
+        list(read_statement(io.BytesIO(b'\x00\x81\xff' * 10), 'statement.csv'))
+
+
+def test_only_the_statement_payment_method_is_matched(app):
+    user_id = create_user('alice').id
+    _payment(user_id, 'TX1', 50, payment_method='Vodafone Cash')
+    _payment(user_id, 'TX1', 50)
+
+    report = reconcile(io.BytesIO(ARABIC_STATEMENT.encode('cp1256')), 'statement.csv', 'InstaPay', dry_run=True)
+
+    assert report['matched_payment_ids'] == [2]
+    assert report['review_count'] == 0
@@ -0,0 +1,41 @@
+from sqlalchemy import func, select, update
+from models.user import db, Ticket, TicketMessage
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_ticket_counters(batch_size=BACKFILL_BATCH_SIZE):
+    """Recompute message_count, last_message_at and last_reply_by_admin from ticket_messages
+
+    Runs one correlated UPDATE per id range so each transaction stays short.
+    Returns the number of tickets updated.
+    """
+    messages = TicketMessage.__table__
+    tickets = Ticket.__table__
+
+    count = select(func.count(messages.c.id)).where(messages.c.ticket_id == tickets.c.id).scalar_subquery()
+    last_at = select(func.max(messages.c.created_at)).where(messages.c.ticket_id == tickets.c.id).scalar_subquery()
+    last_by_admin = (
+        select(messages.c.is_admin_reply)
+        .where(messages.c.ticket_id == tickets.c.id)
+        .order_by(messages.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    max_id = db.session.query(func.max(Ticket.id)).scalar() or 0
+    updated = 0
+    for start in range(0, max_id, batch_size):
+        result = db.session.execute(
+            update(tickets)
+            .where(tickets.c.id > start, tickets.c.id <= start + batch_size)
+            .values(
+                message_count=count,
+                # Tickets without messages sort by their creation time
+                last_message_at=func.coalesce(last_at, tickets.c.created_at),
+                last_reply_by_admin=func.coalesce(last_by_admin, False)
+            )
+        )
+        db.session.commit()
+        updated += result.rowcount
+    return updated
@@ -0,0 +1,174 @@
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models.user import db, TicketMessage
+
+DEFAULT_MESSAGE_LIMIT = 50
+MAX_MESSAGE_LIMIT = 200
+# Seconds a long-poll request is held when no message arrives
+DEFAULT_POLL_TIMEOUT = 25
+MAX_POLL_TIMEOUT = 30
+# Requests held at once per process; beyond this a poll answers immediately
+MAX_WAITERS = 500
+
+
+def _optional_int(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return value
+
+
+def message_page(ticket_id, args):
+    """Messages of a ticket selected by the since_id / before_id / limit request arguments
+
+    since_id returns messages newer than the client's last one (oldest first),
+    before_id pages backwards through history, and limit alone returns the latest
+    page. With none of them the whole conversation is returned, as before.
+    Every variant is a range scan on the (ticket_id, id) index.
+    """
+    since_id = _optional_int(args, 'since_id')
+    before_id = _optional_int(args, 'before_id')
+    limit = _optional_int(args, 'limit')
+    if since_id is not None and before_id is not None:
+        raise ValueError('Use either since_id or before_id, not both')
+
+    query = TicketMessage.query.filter(TicketMessage.ticket_id == ticket_id)
+    if since_id is None and before_id is None and limit is None:
+        messages = query.order_by(TicketMessage.id.asc()).all()
+        return messages, {'has_more': False}
+
+    limit = min(max(limit or DEFAULT_MESSAGE_LIMIT, 1), MAX_MESSAGE_LIMIT)
+    if since_id is not None:
+        messages = query.filter(TicketMessage.id > since_id).order_by(TicketMessage.id.asc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before_id is not None:
+            query = query.filter(TicketMessage.id < before_id)
+        messages = query.order_by(TicketMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+
+    return messages, {
+        # since_id: more new messages are waiting; otherwise: older history remains
+        'has_more': has_more,
+        'oldest_id': messages[0].id if messages else None,
+        'newest_id': messages[-1].id if messages else since_id,
+        'limit': limit
+    }
+
+
+class _TicketWatch:
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Bumped on every committed message for the ticket
+        self.generation = 0
+        self.waiters = 0
+
+    def wait(self, generation, timeout):
+        """Block until a message is committed after generation was read; False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.generation != generation, timeout)
+
+
+class TicketWaiters:
+    """Per-ticket conditions that long-poll requests sleep on until a new message is committed
+
+    Only tickets with a request waiting have an entry. Notifications are
+    in-process; a message committed by another worker is picked up when the
+    client polls again after its timeout.
+    """
+
+    def __init__(self, max_waiters=MAX_WAITERS):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._waiting = 0
+
+    def register(self, ticket_id):
+        """Start watching a ticket; returns (watch, generation) or (None, None) when full"""
+        with self._lock:
+            if self._waiting >= self.max_waiters:
+                return None, None
+            watch = self._watches.get(ticket_id)
+            if watch is None:
+                watch = self._watches[ticket_id] = _TicketWatch()
+            watch.waiters += 1
+            self._waiting += 1
+        with watch.condition:
+            return watch, watch.generation
+
+    def unregister(self, ticket_id, watch):
+        with self._lock:
+            watch.waiters -= 1
+            self._waiting -= 1
+            if not watch.waiters:
+                self._watches.pop(ticket_id, None)
+
+    def notify(self, ticket_ids):
+        with self._lock:
+            watches = [self._watches[ticket_id] for ticket_id in ticket_ids if ticket_id in self._watches]
+        for watch in watches:
+            with watch.condition:
+                watch.generation += 1
+                watch.condition.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {'waiting': self._waiting, 'tickets': len(self._watches), 'max_waiters': self.max_waiters}
+
+
+ticket_waiters = TicketWaiters()
+
+
+@event.listens_for(TicketMessage, 'after_insert')
+def _record_new_message(mapper, connection, target):
+    object_session(target).info.setdefault('new_ticket_messages', set()).add(target.ticket_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_waiters(session):
+    ticket_ids = session.info.pop('new_ticket_messages', None)
+    if ticket_ids:
+        ticket_waiters.notify(ticket_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_new_messages(session):
+    session.info.pop('new_ticket_messages', None)
+
+
+def poll_messages(ticket_id, args):
+    """Like message_page with since_id, but hold the request until a message arrives or the timeout expires
+
+    The watch is registered before the database check, so a message committed
+    between the check and the wait still wakes the request. While waiting no
+    connection is held and nothing is queried.
+    """
+    if _optional_int(args, 'since_id') is None:
+        raise ValueError('since_id is required')
+    timeout = _optional_int(args, 'timeout')
+    timeout = min(DEFAULT_POLL_TIMEOUT if timeout is None else timeout, MAX_POLL_TIMEOUT)
+
+    watch, generation = ticket_waiters.register(ticket_id)
+    try:
+        messages, meta = message_page(ticket_id, args)
+        if messages or watch is None or not timeout:
+            return messages, meta
+
+        # End the read transaction so the connection goes back to the pool while sleeping
+        db.session.rollback()
+        if watch.wait(generation, timeout):
+            messages, meta = message_page(ticket_id, args)
+        return messages, meta
+    finally:
+        if watch is not None:
+            ticket_waiters.unregister(ticket_id, watch)
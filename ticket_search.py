@@ -0,0 +1,210 @@
+import re
+from html import escape
+from sqlalchemy import DDL, event, text
+from models.user import db, Ticket, TicketMessage
+from models.search_index import ARABIC_ARTICLES, TOKEN_PATTERN, normalize_text, strip_article
+
+SEARCH_TABLE = 'ticket_search'
+# Subjects are short and chosen by the user, so a hit there counts more than one in a message
+SUBJECT_WEIGHT = 3.0
+MESSAGE_WEIGHT = 1.0
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_TERMS = 8
+SNIPPET_TOKENS = 16
+REBUILD_BATCH_SIZE = 5000
+
+# Words of the original text, Arabic diacritics and combining accents included, for snippets
+ORIGINAL_WORD = re.compile(r'[\w\u0300-\u036f\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]+')
+
+# One row per subject and per message; prefix indexes keep "452*" style lookups off a full scan
+CREATE_SEARCH_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "subject, message, ticket_id UNINDEXED, message_id UNINDEXED, prefix='2 3')"
+)
+
+INSERT_ROW = text(
+    f'INSERT INTO {SEARCH_TABLE} (subject, message, ticket_id, message_id) '
+    'VALUES (:subject, :message, :ticket_id, :message_id)'
+)
+
+event.listen(Ticket.__table__, 'after_create', DDL(CREATE_SEARCH_TABLE))
+
+
+def ensure_search_table():
+    """Create the FTS table on databases that predate it; True when it was just created"""
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': SEARCH_TABLE}
+    ).first()
+    if exists:
+        return False
+    db.session.execute(text(CREATE_SEARCH_TABLE))
+    db.session.commit()
+    return True
+
+
+def _subject_row(ticket_id, subject):
+    return {'subject': normalize_text(subject), 'message': None, 'ticket_id': ticket_id, 'message_id': None}
+
+
+def _message_row(ticket_id, message_id, message):
+    return {'subject': None, 'message': normalize_text(message), 'ticket_id': ticket_id, 'message_id': message_id}
+
+
+# The index is written in the same flush as the row, so it commits or rolls back with it
+@event.listens_for(Ticket, 'after_insert')
+def _index_ticket(mapper, connection, target):
+    connection.execute(INSERT_ROW, _subject_row(target.id, target.subject))
+
+
+@event.listens_for(TicketMessage, 'after_insert')
+def _index_message(mapper, connection, target):
+    connection.execute(INSERT_ROW, _message_row(target.ticket_id, target.id, target.message))
+
+
+def rebuild_search_index(batch_size=REBUILD_BATCH_SIZE):
+    """Re-index every ticket subject and message; returns the number of rows indexed"""
+    ensure_search_table()
+    db.session.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+
+    indexed = 0
+    for model, columns, build in (
+        (Ticket, (Ticket.id, Ticket.subject), lambda row: _subject_row(row.id, row.subject)),
+        (TicketMessage, (TicketMessage.id, TicketMessage.ticket_id, TicketMessage.message),
+         lambda row: _message_row(row.ticket_id, row.id, row.message))
+    ):
+        last_id = 0
+        while True:
+            rows = (
+                db.session.query(*columns)
+                .filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            db.session.execute(INSERT_ROW, [build(row) for row in rows])
+            indexed += len(rows)
+            last_id = rows[-1].id
+
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return indexed
+
+
+def query_terms(query):
+    """Prefix variants for each term of the query, normalized like the indexed text
+
+    Arabic terms match with or without a definite article, so "طلب" also
+    finds "الطلبات".
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(normalize_text(query)):
+        stem = strip_article(token)
+        variants = [stem]
+        if '\u0600' <= stem[0] <= '\u06ff':
+            variants.extend(article + stem for article in ARABIC_ARTICLES)
+        if variants not in terms:
+            terms.append(variants)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def build_match_query(terms):
+    """FTS5 expression: every term must match, each variant as a prefix"""
+    expressions = []
+    for variants in terms:
+        expression = ' OR '.join(f'"{variant}"*' for variant in variants)
+        expressions.append(f'({expression})' if len(variants) > 1 else expression)
+    return ' AND '.join(expressions)
+
+
+def _is_hit(word, prefixes):
+    return any(token.startswith(prefixes) for token in TOKEN_PATTERN.findall(normalize_text(word)))
+
+
+def highlight_snippet(original, terms, size=SNIPPET_TOKENS):
+    """HTML snippet of the original text around the first hit, hits wrapped in <mark>
+
+    The index only holds normalized text, so hits are found again by
+    normalizing each original word and matching it against the query prefixes.
+    """
+    original = original or ''
+    prefixes = tuple(variant for variants in terms for variant in variants)
+    words = list(ORIGINAL_WORD.finditer(original))
+    if not words:
+        return escape(original[:200])
+
+    hits = [index for index, word in enumerate(words) if _is_hit(word.group(), prefixes)]
+    start = max(0, min(hits[0] - size // 4, len(words) - size)) if hits else 0
+    end = min(len(words), start + size)
+
+    parts = ['…'] if start > 0 else []
+    position = words[start].start()
+    for index in range(start, end):
+        word = words[index]
+        parts.append(escape(original[position:word.start()]))
+        parts.append(f'<mark>{escape(word.group())}</mark>' if index in hits else escape(word.group()))
+        position = word.end()
+    if end < len(words):
+        parts.append('…')
+    else:
+        parts.append(escape(original[position:]))
+    return ''.join(parts)
+
+
+def search_tickets(query, status=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+    """Tickets whose subject or one message matches the query, best first
+
+    Returns (results, has_more). Each result holds the ticket, its bm25 score and
+    a highlighted snippet of the best matching subject or message. Every term
+    has to occur in the same subject or message.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+    match = build_match_query(terms)
+
+    tickets = Ticket.__table__.name
+    status_filter = f'JOIN {tickets} ON {tickets}.id = hits.ticket_id WHERE {tickets}.status = :status' if status else ''
+    # bm25() cannot run inside an aggregate, so rows are ranked in a materialized CTE first;
+    # the bare message_id next to min(score) comes from the best matching row of each ticket
+    ranked = db.session.execute(text(
+        f'WITH hits AS MATERIALIZED ('
+        f'  SELECT ticket_id, message_id, bm25({SEARCH_TABLE}, {SUBJECT_WEIGHT}, {MESSAGE_WEIGHT}) AS score'
+        f'  FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match'
+        f') '
+        f'SELECT hits.ticket_id, hits.message_id, min(hits.score) AS score, count(*) AS hits '
+        f'FROM hits {status_filter} '
+        f'GROUP BY hits.ticket_id ORDER BY score, hits.ticket_id LIMIT :limit OFFSET :offset'
+    ), {'match': match, 'status': status, 'limit': limit + 1, 'offset': offset}).all()
+
+    has_more = len(ranked) > limit
+    ranked = ranked[:limit]
+    if not ranked:
+        return [], False
+
+    tickets_by_id = dict((ticket.id, ticket) for ticket in Ticket.query.filter(Ticket.id.in_([row.ticket_id for row in ranked])))
+    # Snippets come from the original subject or message, not the normalized index text
+    message_ids = [row.message_id for row in ranked if row.message_id is not None]
+    messages = dict(
+        db.session.query(TicketMessage.id, TicketMessage.message).filter(TicketMessage.id.in_(message_ids))
+    ) if message_ids else {}
+
+    results = []
+    for row in ranked:
+        ticket = tickets_by_id.get(row.ticket_id)
+        if ticket is None:
+            continue
+        results.append({
+            'ticket': ticket.to_dict(),
+            # bm25 is negative, lower is better; flip it so higher means more relevant
+            'score': round(-row.score, 4),
+            'matches': row.hits,
+            'message_id': row.message_id,
+            'snippet': highlight_snippet(
+                ticket.subject if row.message_id is None else messages.get(row.message_id), terms
+            )
+        })
+    return results, has_more
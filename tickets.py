@@ -1,5 +1,8 @@
 from flask import Blueprint, request, jsonify, session
-from models.user import db, Ticket, TicketMessage, User
+from models.user import db, Ticket, Upload, User
+from models.stats import ticket_stats
+from models.pagination import paginate, InvalidCursor
+from models.ticket_messages import message_page, poll_messages
 from datetime import datetime
 
 tickets_bp = Blueprint('tickets', __name__, url_prefix='/api/tickets')
@@ -11,8 +14,6 @@ def get_tickets():
             return jsonify({'error': 'Not authenticated'}), 401
         
         user_id = session['user_id']
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
         status = request.args.get('status')
         
         # Build query
@@ -25,20 +26,15 @@ def get_tickets():
         query = query.order_by(Ticket.created_at.desc())
         
         # Paginate results
-        tickets = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        tickets = paginate(query, Ticket, default_per_page=10)
         
         return jsonify({
             'tickets': [ticket.to_dict() for ticket in tickets.items],
-            'total': tickets.total,
-            'pages': tickets.pages,
-            'current_page': page,
-            'per_page': per_page
+            **tickets.meta
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -91,6 +87,13 @@ def create_ticket():
         if priority not in valid_priorities:
             return jsonify({'error': 'Invalid priority'}), 400
         
+        # Attachments are uploaded first through /api/uploads and referenced by id
+        attachment = None
+        if data.get('attachment_id') is not None:
+            attachment = Upload.query.filter_by(id=data['attachment_id'], user_id=user_id).first()
+            if not attachment:
+                return jsonify({'error': 'Attachment not found'}), 400
+        
         # Create ticket
         ticket = Ticket(
             user_id=user_id,
@@ -102,15 +105,13 @@ def create_ticket():
         db.session.add(ticket)
         db.session.flush()  # Get ticket ID
         
-        # Create initial message
-        ticket_message = TicketMessage(
-            ticket_id=ticket.id,
-            user_id=user_id,
-            message=message,
-            is_admin_reply=False
+        # Create initial message (also sets the ticket's message counters)
+        ticket.add_message(
+            user_id,
+            message,
+            attachment_path=attachment.url if attachment else None
         )
         
-        db.session.add(ticket_message)
         db.session.commit()
         
         return jsonify({
@@ -135,15 +136,42 @@ def get_ticket_messages(ticket_id):
         if not ticket:
             return jsonify({'error': 'Ticket not found'}), 404
         
-        # Get messages
-        messages = TicketMessage.query.filter_by(ticket_id=ticket_id).order_by(
-            TicketMessage.created_at.asc()
-        ).all()
+        # Only the requested slice: new messages (since_id) or older history (before_id)
+        messages, meta = message_page(ticket_id, request.args)
+        
+        return jsonify({
+            'messages': [message.to_dict() for message in messages],
+            **meta
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@tickets_bp.route('/<int:ticket_id>/messages/poll', methods=['GET'])
+def poll_ticket_messages(ticket_id):
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        user_id = session['user_id']
+        
+        # Verify ticket ownership
+        ticket = Ticket.query.filter_by(id=ticket_id, user_id=user_id).first()
+        if not ticket:
+            return jsonify({'error': 'Ticket not found'}), 404
+        
+        # Held until a reply newer than since_id is committed or the timeout expires
+        messages, meta = poll_messages(ticket_id, request.args)
         
         return jsonify({
-            'messages': [message.to_dict() for message in messages]
+            'messages': [message.to_dict() for message in messages],
+            **meta
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -175,19 +203,23 @@ def add_ticket_message(ticket_id):
         if ticket.status == 'Closed':
             return jsonify({'error': 'Cannot add message to closed ticket'}), 400
         
-        # Create message
-        ticket_message = TicketMessage(
-            ticket_id=ticket_id,
-            user_id=user_id,
-            message=message,
-            is_admin_reply=False
+        # Attachments are uploaded first through /api/uploads and referenced by id
+        attachment = None
+        if data.get('attachment_id') is not None:
+            attachment = Upload.query.filter_by(id=data['attachment_id'], user_id=user_id).first()
+            if not attachment:
+                return jsonify({'error': 'Attachment not found'}), 400
+        
+        # Create message and bump the ticket's message counters
+        ticket_message = ticket.add_message(
+            user_id,
+            message,
+            attachment_path=attachment.url if attachment else None
         )
         
         # Update ticket status
         ticket.status = 'Awaiting Reply'
-        ticket.updated_at = datetime.utcnow()
         
-        db.session.add(ticket_message)
         db.session.commit()
         
         return jsonify({
@@ -207,20 +239,8 @@ def get_ticket_stats():
         
         user_id = session['user_id']
         
-        # Get ticket statistics
-        total_tickets = Ticket.query.filter_by(user_id=user_id).count()
-        open_tickets = Ticket.query.filter_by(user_id=user_id, status='Open').count()
-        answered_tickets = Ticket.query.filter_by(user_id=user_id, status='Answered').count()
-        awaiting_tickets = Ticket.query.filter_by(user_id=user_id, status='Awaiting Reply').count()
-        closed_tickets = Ticket.query.filter_by(user_id=user_id, status='Closed').count()
-        
-        return jsonify({
-            'total_tickets': total_tickets,
-            'open_tickets': open_tickets,
-            'answered_tickets': answered_tickets,
-            'awaiting_tickets': awaiting_tickets,
-            'closed_tickets': closed_tickets
-        }), 200
+        # All status counts in one GROUP BY query
+        return jsonify(ticket_stats(user_id)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
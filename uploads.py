@@ -0,0 +1,269 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import Blueprint, request, jsonify, session, send_file, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from models.user import db, User, Upload
+from models.images import PILLOW_AVAILABLE, sniff_image_type, process_image
+
+logger = logging.getLogger(__name__)
+
+uploads_bp = Blueprint('uploads', __name__, url_prefix='/api/uploads')
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+PROCESS_WORKERS = 2
+# Images waiting for or in the process pool; further uploads get 503 until it drains
+MAX_PENDING_JOBS = 16
+# Content-addressed files never change, so clients may cache them for a year
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending_jobs = threading.BoundedSemaphore(MAX_PENDING_JOBS)
+# Content hashes being processed; a second upload of the same new file waits for that result
+# instead of overwriting the file process_image is rewriting or submitting a second job
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+        return _executor
+
+
+def upload_folder():
+    return current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.instance_path, 'uploads')
+
+
+def upload_path(sha256, thumbnail=False):
+    # Two-level fan-out keeps directories small
+    name = f'{sha256}_thumb.jpg' if thumbnail else sha256
+    return os.path.join(upload_folder(), sha256[:2], name)
+
+
+def _save_stream(stream):
+    """Copy the upload to disk chunk by chunk while hashing it; returns (sha256, size, content_type, temp path)"""
+    os.makedirs(upload_folder(), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder(), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    content_type = sniff_image_type(chunk)
+                    if not content_type:
+                        raise ValueError('Only JPEG, PNG, GIF and WebP images are allowed')
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise ValueError(f'File is larger than {MAX_UPLOAD_SIZE // (1024 * 1024)} MB')
+                digest.update(chunk)
+                output.write(chunk)
+        if size == 0:
+            raise ValueError('File is empty')
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return digest.hexdigest(), size, content_type, temp_path
+
+
+def _on_processed(app, sha256, future):
+    """Record the worker result for every upload of this content"""
+    try:
+        with app.app_context():
+            try:
+                width, height = future.result()
+                values = {'status': 'ready', 'width': width, 'height': height}
+            except Exception as e:
+                logger.warning('Processing upload %s failed: %s', sha256, e)
+                values = {'status': 'failed'}
+            # Under the lock, so a concurrent copy is either updated here or sees the result
+            with _in_flight_lock:
+                try:
+                    Upload.query.filter_by(sha256=sha256).update(values, synchronize_session=False)
+                    db.session.commit()
+                finally:
+                    _in_flight.discard(sha256)
+    finally:
+        _pending_jobs.release()
+
+
+@uploads_bp.route('/', methods=['POST'])
+def create_upload():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        # Werkzeug stops reading past this limit, with or without Content-Length (chunked bodies)
+        request.max_content_length = MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+        if request.content_length and request.content_length > request.max_content_length:
+            return jsonify({'error': f'File is larger than {MAX_UPLOAD_SIZE // (1024 * 1024)} MB'}), 413
+        
+        # Without Pillow nothing can be stripped of EXIF/GPS data, so no upload would ever be served
+        if not PILLOW_AVAILABLE:
+            return jsonify({'error': 'Image uploads are unavailable: Pillow is not installed on the server'}), 503
+        
+        # Reserve a processing slot before reading the body; shed load when the pool is saturated
+        if not _pending_jobs.acquire(blocking=False):
+            response = jsonify({'error': 'Upload processing is busy, please retry shortly'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        submitted = False
+        try:
+            file = request.files.get('file')
+            if not file or not file.filename:
+                return jsonify({'error': 'file is required'}), 400
+            
+            try:
+                sha256, size, content_type, temp_path = _save_stream(file.stream)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            user_id = session['user_id']
+            upload = Upload.query.filter_by(user_id=user_id, sha256=sha256).first()
+            if upload:
+                os.remove(temp_path)
+                return jsonify({'upload': upload.to_dict(), 'duplicate': True}), 200
+            
+            def new_upload(processed):
+                upload = Upload(
+                    user_id=user_id,
+                    sha256=sha256,
+                    content_type=content_type,
+                    size=size,
+                    original_name=file.filename[:255],
+                    status=processed.status if processed else 'processing',
+                    width=processed.width if processed else None,
+                    height=processed.height if processed else None
+                )
+                db.session.add(upload)
+                db.session.commit()
+                return upload
+            
+            # Identical content is stored and processed once no matter who uploads it
+            path = upload_path(sha256)
+            with _in_flight_lock:
+                claimed = False
+                if sha256 in _in_flight:
+                    # _on_processed takes the lock too, so it will update this row
+                    os.remove(temp_path)
+                    upload = new_upload(None)
+                else:
+                    processed = Upload.query.filter(Upload.sha256 == sha256, Upload.status != 'processing').first()
+                    if processed:
+                        if os.path.exists(path):
+                            os.remove(temp_path)
+                        else:
+                            os.makedirs(os.path.dirname(path), exist_ok=True)
+                            os.replace(temp_path, path)
+                        upload = new_upload(processed)
+                    else:
+                        _in_flight.add(sha256)
+                        claimed = True
+            
+            if claimed:
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    upload = new_upload(None)
+                    
+                    # Thumbnail and EXIF stripping run in another process; the request returns now
+                    future = _get_executor().submit(process_image, path, upload_path(sha256, thumbnail=True), content_type)
+                    app = current_app._get_current_object()
+                    future.add_done_callback(lambda done: _on_processed(app, sha256, done))
+                    submitted = True
+                finally:
+                    if not submitted:
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+                        with _in_flight_lock:
+                            _in_flight.discard(sha256)
+            
+            return jsonify({'upload': upload.to_dict(), 'duplicate': False}), 201
+        finally:
+            if not submitted:
+                _pending_jobs.release()
+    
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        return jsonify({'error': f'File is larger than {MAX_UPLOAD_SIZE // (1024 * 1024)} MB'}), 413
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+def _readable_upload(sha256):
+    """Any upload row for this content if the caller owns one (or is an admin)"""
+    user = User.query.get(session['user_id'])
+    query = Upload.query.filter_by(sha256=sha256)
+    if not user or not user.is_admin:
+        query = query.filter_by(user_id=session['user_id'])
+    return query.first()
+
+
+def _send_upload(sha256, thumbnail):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    upload = _readable_upload(sha256.lower())
+    if not upload:
+        return jsonify({'error': 'File not found'}), 404
+    
+    # The file is rewritten once EXIF is stripped; only the final bytes get cached
+    if upload.status == 'processing':
+        response = jsonify({'status': 'processing'})
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    
+    # Only files whose metadata was stripped are served. Rows marked ready by earlier
+    # releases without Pillow have no dimensions and still carry their EXIF/GPS data.
+    if upload.status != 'ready' or upload.width is None:
+        return jsonify({'error': 'File could not be processed'}), 422
+    
+    path = upload_path(upload.sha256, thumbnail=thumbnail)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Thumbnail not available' if thumbnail else 'File not found'}), 404
+    
+    # conditional=True answers If-None-Match and Range requests (206 partial content)
+    response = send_file(
+        path,
+        mimetype='image/jpeg' if thumbnail else upload.content_type,
+        conditional=True,
+        etag=f'{upload.sha256}-thumb' if thumbnail else upload.sha256,
+        max_age=CACHE_MAX_AGE
+    )
+    # Receipts are private: browsers may keep them, shared caches may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+@uploads_bp.route('/<sha256>', methods=['GET'])
+def get_upload(sha256):
+    try:
+        return _send_upload(sha256, thumbnail=False)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@uploads_bp.route('/<sha256>/thumbnail', methods=['GET'])
+def get_upload_thumbnail(sha256):
+    try:
+        return _send_upload(sha256, thumbnail=True)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
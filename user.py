@@ -1,15 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from decimal import Decimal
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
 class User(db.Model):
+    __table_args__ = (
+        db.Index('idx_user_created', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
-    balance = db.Column(db.Numeric(10, 2), default=0.00)
+    # الرصيد بالقروش؛ يُعدل فقط عبر balance.py بتحديثات ذرية
+    balance_minor = db.Column(db.BigInteger, default=0, nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     two_factor_enabled = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -21,6 +27,10 @@ class User(db.Model):
     tickets = db.relationship('Ticket', backref='user', lazy=True)
     notifications = db.relationship('Notification', backref='user', lazy=True)
 
+    @property
+    def balance(self):
+        return Decimal(self.balance_minor or 0) / 100
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -51,12 +61,27 @@ class Service(db.Model):
     max_quantity = db.Column(db.Integer, nullable=False)
     description = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True)
+    # رقم الخدمة لدى المزود الخارجي (يُستخدم رقم الخدمة المحلي إذا كان فارغاً)
+    provider_service_id = db.Column(db.String(64))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # العلاقات
     orders = db.relationship('Order', backref='service', lazy=True)
 
+    def validate_quantity(self, quantity):
+        """Return an error message if this quantity cannot be ordered, otherwise None"""
+        if not self.is_active:
+            return 'Service is not available'
+        if quantity < self.min_quantity:
+            return f'Minimum quantity is {self.min_quantity}'
+        if quantity > self.max_quantity:
+            return f'Maximum quantity is {self.max_quantity}'
+        return None
+
+    def calculate_price(self, quantity):
+        return (quantity / 1000) * float(self.price_per_1000)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -70,16 +95,50 @@ class Service(db.Model):
             'is_active': self.is_active
         }
 
+class ServiceStat(db.Model):
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id'), primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    # مجموع أوزان الطلبات المتناقصة زمنياً (انظر popularity.py)
+    popularity_score = db.Column(db.Float, default=0.0, nullable=False, index=True)
+    last_ordered_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'service_id': self.service_id,
+            'order_count': self.order_count,
+            'popularity_score': self.popularity_score,
+            'last_ordered_at': self.last_ordered_at.isoformat() if self.last_ordered_at else None
+        }
+
 class Order(db.Model):
+    __table_args__ = (
+        db.Index('idx_order_created', 'created_at', 'id'),
+        db.Index('idx_order_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('idx_order_status_created', 'status', 'created_at', 'id'),
+        db.Index('idx_order_fulfillment', 'status', 'next_attempt_at'),
+        db.Index('idx_order_target', 'target_hash', 'service_id'),
+        db.Index('idx_order_status_updated', 'status', 'updated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
     link = db.Column(db.String(500), nullable=False)
+    # بصمة الرابط بعد توحيده (انظر links.py) لكشف الطلبات المكررة النشطة
+    target_hash = db.Column(db.String(40))
     quantity = db.Column(db.Integer, nullable=False)
     charge = db.Column(db.Numeric(10, 2), nullable=False)
+    # ما أعيد للرصيد من قيمة الطلب (إلغاء، تنفيذ جزئي، استرداد) حتى لا يُسترد مرتين
+    refunded_amount = db.Column(db.Numeric(10, 2), default=0, nullable=False)
     start_count = db.Column(db.Integer, default=0)
     remains = db.Column(db.Integer, default=0)
     status = db.Column(db.String(20), default='Pending')
+    # تنفيذ الطلب لدى المزود (انظر fulfillment.py)
+    provider_order_id = db.Column(db.String(64), index=True)
+    fulfillment_attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -91,14 +150,69 @@ class Order(db.Model):
             'link': self.link,
             'quantity': self.quantity,
             'charge': float(self.charge),
+            'refunded_amount': float(self.refunded_amount or 0),
             'start_count': self.start_count,
             'remains': self.remains,
             'status': self.status,
+            'provider_order_id': self.provider_order_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'service_name': self.service.name if self.service else None
         }
 
+# الطلبات المنتهية القديمة تُنقل إلى هذا الجدول (انظر archive.py) ليبقى جدول الطلبات صغيراً
+class OrderArchive(db.Model):
+    __tablename__ = 'order_archive'
+    __table_args__ = (
+        db.Index('idx_order_archive_created', 'created_at', 'id'),
+        db.Index('idx_order_archive_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('idx_order_archive_status_created', 'status', 'created_at', 'id'),
+    )
+
+    # نفس رقم الطلب الأصلي
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id'), nullable=False)
+    link = db.Column(db.String(500), nullable=False)
+    target_hash = db.Column(db.String(40))
+    quantity = db.Column(db.Integer, nullable=False)
+    charge = db.Column(db.Numeric(10, 2), nullable=False)
+    refunded_amount = db.Column(db.Numeric(10, 2), default=0, nullable=False)
+    start_count = db.Column(db.Integer, default=0)
+    remains = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), nullable=False)
+    provider_order_id = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    service = db.relationship('Service', lazy=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'service_id': self.service_id,
+            'link': self.link,
+            'quantity': self.quantity,
+            'charge': float(self.charge),
+            'refunded_amount': float(self.refunded_amount or 0),
+            'start_count': self.start_count,
+            'remains': self.remains,
+            'status': self.status,
+            'provider_order_id': self.provider_order_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'service_name': self.service.name if self.service else None,
+            'archived': True
+        }
+
 class Payment(db.Model):
+    __table_args__ = (
+        db.Index('idx_payment_created', 'created_at', 'id'),
+        db.Index('idx_payment_user_created', 'user_id', 'created_at', 'id'),
+        # رقم العملية لا يتكرر لنفس وسيلة الدفع
+        db.Index('uq_payment_transaction', 'payment_method', 'transaction_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     amount = db.Column(db.Numeric(10, 2), nullable=False)
@@ -106,6 +220,8 @@ class Payment(db.Model):
     transaction_id = db.Column(db.String(100))
     status = db.Column(db.String(20), default='Pending')
     notes = db.Column(db.Text)
+    # رابط صورة إيصال التحويل المرفوعة (انظر uploads.py)
+    receipt_image = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -118,21 +234,54 @@ class Payment(db.Model):
             'transaction_id': self.transaction_id,
             'status': self.status,
             'notes': self.notes,
+            'receipt_image': self.receipt_image,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 class Ticket(db.Model):
+    __table_args__ = (
+        db.Index('idx_ticket_created', 'created_at', 'id'),
+        db.Index('idx_ticket_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('idx_ticket_last_message', 'last_message_at', 'id'),
+        db.Index('idx_ticket_status_last_message', 'status', 'last_message_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     subject = db.Column(db.String(200), nullable=False)
     status = db.Column(db.String(20), default='Open')
     priority = db.Column(db.String(10), default='Normal')
+    # عدادات مخزنة مسبقاً تُحدّث مع كل رسالة (انظر add_message) حتى لا تُقرأ جدول الرسائل في القوائم
+    message_count = db.Column(db.Integer, default=0, nullable=False)
+    # يبدأ بوقت إنشاء التذكرة ولا يكون فارغاً حتى يصلح للترقيم بالمؤشر
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_reply_by_admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # العلاقات
     messages = db.relationship('TicketMessage', backref='ticket', lazy=True)
 
+    def add_message(self, user_id, message, is_admin_reply=False, attachment_path=None):
+        """Add a message and update the ticket counters in the same transaction"""
+        now = datetime.utcnow()
+        ticket_message = TicketMessage(
+            ticket_id=self.id,
+            user_id=user_id,
+            message=message,
+            is_admin_reply=is_admin_reply,
+            attachment_path=attachment_path,
+            created_at=now
+        )
+        db.session.add(ticket_message)
+
+        # زيادة العداد داخل قاعدة البيانات لتفادي فقدان التحديثات المتزامنة
+        self.message_count = Ticket.message_count + 1
+        self.last_message_at = now
+        self.last_reply_by_admin = is_admin_reply
+        self.updated_at = now
+        return ticket_message
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -141,10 +290,17 @@ class Ticket(db.Model):
             'status': self.status,
             'priority': self.priority,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'messages_count': len(self.messages)
+            'messages_count': self.message_count or 0,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_reply_by_admin': bool(self.last_reply_by_admin)
         }
 
 class TicketMessage(db.Model):
+    __table_args__ = (
+        # جلب الرسائل الجديدة (since_id) أو الأقدم (before_id) بمسح نطاق واحد
+        db.Index('idx_ticket_message_ticket_id', 'ticket_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -164,6 +320,42 @@ class TicketMessage(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+# الملفات المرفوعة تُخزن مرة واحدة حسب بصمة المحتوى، ولكل مستخدم سجل يشير إليها
+class Upload(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'sha256', name='uq_upload_user_sha256'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    content_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    original_name = db.Column(db.String(255))
+    # processing, ready, failed
+    status = db.Column(db.String(20), default='processing', nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def url(self):
+        return f'/api/uploads/{self.sha256}'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'thumbnail_url': f'{self.url}/thumbnail',
+            'content_type': self.content_type,
+            'size': self.size,
+            'original_name': self.original_name,
+            'status': self.status,
+            'width': self.width,
+            'height': self.height,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -182,6 +374,22 @@ class Notification(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class IdempotencyKey(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='uq_idempotency_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), default='processing', nullable=False)  # processing, completed
+    response_status = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class SiteSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     setting_key = db.Column(db.String(100), unique=True, nullable=False)